@@ -0,0 +1,37 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+
+class AsyncLoopThread(threading.Thread):
+    """
+    専用のスレッドでイベントループを回し、コルーチンを投入して実行するためのスレッド.
+    UIのイベントループとは別のループで通信などを行い、UI側は結果を待つだけにしたい場合に使う.
+    """
+
+    def __init__(self):
+        super().__init__(name="AsyncLoopThread", daemon=True)
+        # start() 前に submit() されてもよいよう、ループは先に作っておく
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> concurrent.futures.Future[T]:
+        """コルーチンをこのスレッドのイベントループで実行する. 結果は concurrent.futures.Future で受け取る"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def run_coroutine(self, coro: Coroutine[Any, Any, T]) -> T:
+        """呼び出し元のイベントループをブロックせずに、このスレッドでコルーチンを実行して結果を待つ"""
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def stop(self):
+        """イベントループを停止する (スレッドはループの停止後に終了する)"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -1,217 +1,567 @@
+import copy
 import json
 import os
-from typing import Any, Dict, List, Optional, Tuple
+import sys
+import tempfile
+import threading
+from collections import ChainMap
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, ClassVar, Dict, FrozenSet, Iterator, List, Mapping, MutableMapping, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson が無い環境では標準の json モジュールを使う
+    orjson = None
+
+
+def _json_loads(data: bytes) -> Any:
+    """JSONをパースする (orjson があれば使う)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """JSONをインデント付きのUTF-8バイト列にする (orjson があれば使う)"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def _deep_merge(dst: Dict[str, Any], src: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    src の値で dst をネストされた辞書ごと上書きし、dst を返す.
+    両方が辞書のキーは中身をマージし、それ以外は src の値で置き換える.
+    再帰呼び出しの代わりにスタックを使い、深さの制限や関数呼び出しのコストを避ける.
+    """
+    stack = [(dst, src)]
+    while stack:
+        target, source = stack.pop()
+        for key, value in source.items():
+            current = target.get(key)
+            if isinstance(current, dict) and isinstance(value, Mapping):
+                stack.append((current, value))
+            else:
+                target[key] = value
+    return dst
+
+
+_MISSING = object()
+
+# 設定のキー。JSONから読み込んだキーも intern し、辞書の検索を参照の比較で済ませる
+_K_ACTIVE = sys.intern("active_server_key")
+_K_EXTERNAL_URL = sys.intern("external_mcp_url")
+_K_MOCK = sys.intern("internal_mock_config")
+_K_SERVERS = sys.intern("mcpServers")
+_K_ENABLED = sys.intern("enabled")
+_K_TYPE = sys.intern("type")
+_K_PORT = sys.intern("port")
+_K_HOST = sys.intern("host")
+_K_URL = sys.intern("url")
+_K_CWD = sys.intern("cwd")
+_K_COMMAND = sys.intern("command")
+_K_ARGS = sys.intern("args")
+
+
+def _intern_keys(data: Any) -> Any:
+    """パースしたJSONの辞書のキーを再帰的に intern する"""
+    if isinstance(data, dict):
+        return {sys.intern(key): _intern_keys(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_intern_keys(value) for value in data]
+    return data
+
+
+def _freeze(value: Any) -> Any:
+    """設定値を読み取り専用にする (辞書は MappingProxyType、リストはタプルに再帰的に変換する)"""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+@dataclass(frozen=True)
+class ActiveSnapshot:
+    """ある時点のアクティブなサーバーに関する設定をまとめたもの (ConfigManager.snapshot() が返す)"""
+
+    server_type: Optional[str]
+    mcp_url: Optional[str]
+    server_key: str
+    server_config: Optional[Mapping[str, Any]]
+    # 自動起動が有効な管理対象サーバーのキー
+    enabled_servers: FrozenSet[str] = frozenset()
+
+
+@dataclass(frozen=True, slots=True)
+class ServerEntry:
+    """管理対象サーバー1件分の設定のうち、一覧表示や自動起動の判定に使う項目 (ConfigManager.get_entry() が返す)"""
+
+    enabled: bool
+    command: Optional[str] = None
+    args: Tuple[str, ...] = ()
+    port: Optional[int] = None
 
 
 class ConfigManager:
     """設定ファイル (config.json) の読み書きを管理するクラス"""
 
-    def __init__(self, config_file="config.json"):
-        self.config_file = config_file
-        # より詳細なデフォルト設定
-        self.default_config = {
-            "active_server_key": "internal_mock",  # デフォルトは内蔵モック
-            "external_mcp_url": None,
-            "internal_mock_config": {"enabled": True, "type": "sse", "port": 8001},
-            "mcpServers": {},  # デフォルトは空
+    # より詳細なデフォルト設定。変更不可のビューとしてクラスで1つだけ持ち、全インスタンスで共有する
+    _DEFAULTS: ClassVar[Mapping[str, Any]] = MappingProxyType(
+        {
+            _K_ACTIVE: "internal_mock",  # デフォルトは内蔵モック
+            _K_EXTERNAL_URL: None,
+            _K_MOCK: MappingProxyType({_K_ENABLED: True, _K_TYPE: "sse", _K_PORT: 8001}),
+            _K_SERVERS: MappingProxyType({}),  # デフォルトは空
         }
+    )
+
+    # _get で使うドット区切りパスの分割結果 (全インスタンスで共有)
+    _PATH_PARTS: ClassVar[Dict[str, Tuple[str, ...]]] = {}
+
+    def __init__(self, config_file="config.json", verbose: bool = False):
+        self.config_file = config_file
+        # True の場合のみ警告を表示する (無効時はメッセージの組み立て自体を省略する)
+        self._verbose = verbose
+        # 読み込んだ設定ファイルの内容 (デフォルト未適用) と、その時点の更新時刻
+        self._cache: Optional[Dict[str, Any]] = None
+        self._mtime_ns: Optional[int] = None
+        # ディスク上の設定ファイルの内容 (最後に読み書きしたバイト列)。同じ内容の書き込みを省略するのに使う
+        self._last_written_bytes: Optional[bytes] = None
+        # デフォルト適用済みの設定の読み取り専用コピー (get_config 用のメモ化)。_dirty の間は再計算が必要
+        self._merged: Optional[Mapping[str, Any]] = None
+        self._dirty = True
+        # 設定が変わるたびに増える版数と、版数付きのサーバー設定解決結果 {server_key: (版数, 設定)}
+        self._version = 0
+        self._resolved_cache: Dict[Optional[str], Tuple[int, Optional[Mapping[str, Any]]]] = {}
+        # 版数付きのアクティブサーバーのスナップショット (版数, スナップショット)
+        self._snapshot: Optional[Tuple[int, ActiveSnapshot]] = None
+        # 版数付きの管理対象サーバーの設定一覧 (版数, {server_key: ServerEntry})
+        self._entries: Optional[Tuple[int, Dict[str, ServerEntry]]] = None
+        # 版数付きの mcpServers の作業ディレクトリの解決結果 (版数, {server_key: 絶対パス})
+        self._resolved_cwds: Optional[Tuple[int, Dict[str, Optional[str]]]] = None
+        # ディスクへのアクセスは最初に設定が必要になるまで遅延させる
+        self._initialized = False
+        # 設定ファイルを新しく作るときのパーミッション (open() で作る場合と同じく umask を適用する)
+        umask = os.umask(0)
+        os.umask(umask)
+        self._new_file_mode = 0o666 & ~umask
+        # 保存はUIのイベントループを止めないよう別スレッドで行われるため、読み込み・マージ・書き込みを排他する
+        # (メソッド同士が呼び合うため再入可能なロックを使う)
+        self._lock = threading.RLock()
+
+    def _ensure_initialized(self):
+        """
+        初回アクセス時に一度だけ呼ばれる初期化処理.
+        ファイルが無い場合はデフォルト設定で作成し (ユーザーが編集できるように)、
+        既存ファイルがある場合はデフォルトにないキーを追加する.
+        """
+        self._initialized = True
         if not os.path.exists(self.config_file):
-            self.save_config(self.default_config)
+            self.save_config(self._materialize(self._DEFAULTS), merge_with_current=False)
         else:
-            # 既存ファイルがある場合、デフォルトにないキーを追加する
             self._ensure_config_keys()
 
     def _ensure_config_keys(self):
         """既存の設定ファイルにデフォルトのキーが存在するか確認し、なければ追加する"""
         config = self.load_config(apply_defaults=False)  # 生のデータをロード
-        updated = False
-        for key, default_value in self.default_config.items():
-            if key not in config:
-                config[key] = default_value
-                updated = True
-            # ネストされた辞書もチェック (例: internal_mock_config)
-            elif isinstance(default_value, dict) and isinstance(config.get(key), dict):
-                internal_updated = False
-                for sub_key, sub_default_value in default_value.items():
-                    if sub_key not in config[key]:
-                        config[key][sub_key] = sub_default_value
-                        internal_updated = True
-                if internal_updated:
-                    updated = True
+        # 既に全てのキーが揃っている場合は、マージも書き込みも行わない
+        if not (self._DEFAULTS.keys() - config.keys()) and all(
+            default_value.keys() <= config[key].keys()
+            for key, default_value in self._DEFAULTS.items()
+            if isinstance(default_value, Mapping) and isinstance(config[key], dict)
+        ):
+            return
+        # デフォルトをベースに読み込んだ値で上書き (ネストされた辞書も同様、例: internal_mock_config)
+        merged = _deep_merge(self._materialize(self._DEFAULTS), config)
+        updated = merged != config
 
         if updated:
             print("設定ファイルに不足しているキーを追加しました。")
-            self.save_config(config, merge_with_current=False)  # 更新した内容で上書き
+            self.save_config(merged, merge_with_current=False)  # 更新した内容で上書き
+
+    def _stat_mtime_ns(self) -> Optional[int]:
+        """設定ファイルの更新時刻 (ナノ秒) を返す. ファイルが無い場合は None"""
+        try:
+            return os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return None
 
-    def load_config(self, apply_defaults=True) -> Dict[str, Any]:
+    def _load_raw(self) -> Dict[str, Any]:
+        """
+        設定ファイルの内容をキャッシュから返す.
+        ファイルの更新時刻が変わっていない限り、ディスクからの再読み込みとJSONのパースは行わない.
+        """
+        with self._lock:
+            if not self._initialized:
+                self._ensure_initialized()
+
+            # stat だけで変更の有無を判定する (open + read + パースよりずっと安い)
+            mtime_ns = self._stat_mtime_ns()
+            if self._cache is not None and mtime_ns == self._mtime_ns:
+                return self._cache
+
+            config_data = {}
+            if mtime_ns is not None:
+                try:
+                    with open(self.config_file, "rb") as f:
+                        raw_bytes = f.read()
+                    self._last_written_bytes = raw_bytes
+                    config_data = _intern_keys(_json_loads(raw_bytes))
+                except json.JSONDecodeError:
+                    print(f"エラー: {self.config_file} のJSON形式が不正です。")
+                    # 不正な場合でもデフォルト適用のために空dictを返すか、例外を投げるか
+                except Exception as e:
+                    print(f"設定ファイルの読み込み中にエラーが発生しました: {e}")
+
+            self._cache = config_data
+            self._mtime_ns = mtime_ns
+            self._dirty = True
+            self._version += 1
+            return self._cache
+
+    def _compute_merged(self, config_data: Dict[str, Any]) -> ChainMap:
+        """
+        config_data を優先し、無いキーはデフォルト値にフォールバックするビューを返す.
+        辞書のコピーは行わず、ネストされた辞書 (例: internal_mock_config) も同様に ChainMap で重ねる.
+        """
+        # ファイル側に辞書が無い場合も空の辞書を重ね、load_config() の結果を変更できるようにする
+        nested = {
+            key: ChainMap(config_data[key] if isinstance(config_data.get(key), dict) else {}, default_value)
+            for key, default_value in self._DEFAULTS.items()
+            if isinstance(default_value, Mapping)
+        }
+        return ChainMap(nested, config_data, self._DEFAULTS)
+
+    @staticmethod
+    def _materialize(config: Mapping[str, Any]) -> Dict[str, Any]:
+        """ChainMap やデフォルト値のビューを、JSONに書き出せる通常の辞書に変換する"""
+        return {key: dict(value) if isinstance(value, Mapping) else value for key, value in config.items()}
+
+    def load_config(self, apply_defaults=True) -> MutableMapping[str, Any]:
         """
         設定ファイルを読み込む.
-        apply_defaults=Trueの場合、読み込んだデータにデフォルト値をマージする.
+        apply_defaults=Trueの場合、読み込んだデータの上にデフォルト値を重ねた ChainMap を返す.
         apply_defaults=Falseの場合、ファイルの内容をそのまま返す.
         """
-        config_data = {}
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, "r", encoding="utf-8") as f:
-                    config_data = json.load(f)
-            except json.JSONDecodeError:
-                print(f"エラー: {self.config_file} のJSON形式が不正です。")
-                # 不正な場合でもデフォルト適用のために空dictを返すか、例外を投げるか
-            except Exception as e:
-                print(f"設定ファイルの読み込み中にエラーが発生しました: {e}")
+        config_data = copy.deepcopy(self._load_raw())
 
         if apply_defaults:
-            # デフォルト値をベースに、読み込んだ値で上書きする形でマージ
-            final_config = self.default_config.copy()
-            # ネストされた辞書も適切にマージする (簡易的なディープマージ)
-            for key, value in config_data.items():
-                if key in final_config and isinstance(final_config[key], dict) and isinstance(value, dict):
-                    final_config[key].update(value)
-                else:
-                    final_config[key] = value
-            return final_config
+            return self._compute_merged(config_data)
         else:
             return config_data  # ファイルの内容そのまま
 
-    def save_config(self, config_data: Dict[str, Any], merge_with_current=True) -> bool:
+    def _write(self, data_to_save: Dict[str, Any]) -> bool:
+        """
+        通常の辞書をファイルに書き込み、その内容をそのままキャッシュする.
+        data_to_save は以降キャッシュとして保持されるため、呼び出し側で変更しないこと.
+        書き込み途中で落ちても設定ファイルが壊れないよう、一時ファイルに書いてから置き換える.
+        """
+        with self._lock:
+            payload = _json_dumps(data_to_save)
+            if payload == self._last_written_bytes and self._stat_mtime_ns() == self._mtime_ns:
+                # ディスク上の内容と同一なので書き込まない (更新時刻も変えない)
+                return True
+
+            tmp_path = None
+            try:
+                config_dir = os.path.dirname(os.path.abspath(self.config_file))
+                with tempfile.NamedTemporaryFile("wb", dir=config_dir, suffix=".tmp", delete=False) as f:
+                    tmp_path = f.name
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # 一時ファイルは 0600 で作られるため、既存ファイルのパーミッションを引き継ぐ
+                # (新しく作る場合は umask に従ったパーミッションにする)
+                if os.path.exists(self.config_file):
+                    os.chmod(tmp_path, os.stat(self.config_file).st_mode)
+                else:
+                    os.chmod(tmp_path, self._new_file_mode)
+                os.replace(tmp_path, self.config_file)
+                tmp_path = None
+                # 書き込んだ内容をそのままキャッシュし、次回の読み込みを省略する
+                self._cache = data_to_save
+                self._mtime_ns = self._stat_mtime_ns()
+                self._last_written_bytes = payload
+                self._dirty = True
+                self._version += 1
+                return True
+            except Exception as e:
+                print(f"設定ファイルの保存中にエラーが発生しました: {e}")
+                return False
+            finally:
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def save_config(self, config_data: Mapping[str, Any], merge_with_current=True) -> bool:
         """設定ファイルに書き込む. merge_with_current=Trueの場合、現在の設定とマージする."""
-        try:
+        with self._lock:
             data_to_save = config_data
             if merge_with_current:
-                current_config = self.load_config()  # デフォルト適用済みの現在設定
-                # current_config をベースに、引数の config_data で上書き
-                for key, value in config_data.items():
-                    if key in current_config and isinstance(current_config[key], dict) and isinstance(value, dict):
-                        current_config[key].update(value)
-                    else:
-                        current_config[key] = value
-                data_to_save = current_config
-
-            with open(self.config_file, "w", encoding="utf-8") as f:
-                json.dump(data_to_save, f, indent=4, ensure_ascii=False)
-            return True
-        except Exception as e:
-            print(f"設定ファイルの保存中にエラーが発生しました: {e}")
-            return False
-
-    def get_config(self) -> Dict[str, Any]:
-        """現在の全設定を取得する (デフォルト適用済み)"""
-        return self.load_config()
+                # キャッシュ済みの現在設定 (デフォルト適用済み) をベースに、引数の config_data で上書き
+                # (マージ先を書き換えるため、キャッシュ自体はコピーしてから使う)
+                current_config = self._materialize(self._compute_merged(copy.deepcopy(self._load_raw())))
+                data_to_save = _deep_merge(current_config, config_data)
+            # JSONへの書き出し直前にだけ通常の辞書へ変換する。
+            # 呼び出し側のオブジェクトがキャッシュと共有されないようにコピーしておく
+            return self._write(copy.deepcopy(self._materialize(data_to_save)))
+
+    def _get(self, dotted: str, default: Any = None) -> Any:
+        """
+        "internal_mock_config.port" のようなドット区切りのパスで値を1つ取得する.
+        設定ファイルの内容とデフォルト設定を並行してたどり、ファイル側に無ければデフォルト値を返す.
+        マージや辞書のコピーは行わない.
+        """
+        parts = self._PATH_PARTS.get(dotted)
+        if parts is None:
+            parts = self._PATH_PARTS[dotted] = tuple(sys.intern(part) for part in dotted.split("."))
+
+        node: Any = self._load_raw()
+        default_node: Any = self._DEFAULTS
+        for part in parts:
+            node = node.get(part, _MISSING) if isinstance(node, dict) else _MISSING
+            default_node = default_node.get(part, _MISSING) if isinstance(default_node, Mapping) else _MISSING
+        if node is not _MISSING:
+            return node
+        if default_node is not _MISSING:
+            return default_node
+        return default
+
+    def get_version(self) -> int:
+        """設定の版数を返す. 保存やファイルの外部変更のたびに増えるため、キャッシュの無効化判定に使える"""
+        self._load_raw()  # ファイルが外部で変更されていれば読み込み直して版数を進める
+        return self._version
+
+    def get_config(self) -> Mapping[str, Any]:
+        """
+        現在の全設定を取得する (デフォルト適用済み).
+        マージ結果はメモ化して共有するため、ネストされた辞書まで読み取り専用にしたコピーを返す (リストはタプルになる).
+        キャッシュとは共有しないため、設定ファイルの内容を書き換えることはない.
+        変更して保存したい場合は load_config() で取得したコピーを使うこと.
+        """
+        with self._lock:
+            raw = self._load_raw()
+            if self._merged is None or self._dirty:
+                self._merged = _freeze(self._compute_merged(raw))
+                self._dirty = False
+            return self._merged
 
     def set_config_value(self, key: str, value: Any) -> bool:
         """特定の設定値を更新する (トップレベルキーのみ)"""
-        # ネストされたキーの更新は別途専用メソッドを用意するか、
-        # get_config()で取得して変更し、save_config()で全体を保存する
-        config = self.load_config()
-        config[key] = value
-        return self.save_config(config, merge_with_current=False)  # 更新した内容で上書き
+        with self._lock:
+            # ネストされたキーの更新は別途専用メソッドを用意するか、
+            # load_config()で取得して変更し、save_config()で全体を保存する
+            # キャッシュ済みの設定から新しい辞書を組み立て、読み込みなしで1回だけ書き込む
+            config = self._materialize(self._compute_merged(self._load_raw()))
+            config[key] = value
+            return self._write(config)
 
     def get_active_server_key(self) -> str:
         """現在アクティブなサーバーのキーを取得する"""
-        return self.get_config().get("active_server_key", "internal_mock")
+        return self._get(_K_ACTIVE, "internal_mock")
 
     def set_active_server_key(self, key: str) -> bool:
         """アクティブなサーバーキーを設定する"""
-        return self.set_config_value("active_server_key", key)
+        return self.set_config_value(_K_ACTIVE, key)
 
     def get_external_mcp_url(self) -> Optional[str]:
         """外部MCPサーバーのURLを取得する"""
-        return self.get_config().get("external_mcp_url")
+        return self._get(_K_EXTERNAL_URL)
 
     def set_external_mcp_url(self, url: Optional[str]) -> bool:
         """外部MCPサーバーのURLを設定する"""
-        return self.set_config_value("external_mcp_url", url)
+        return self.set_config_value(_K_EXTERNAL_URL, url)
 
-    def get_internal_mock_config(self) -> Dict[str, Any]:
-        """内蔵Pythonモックサーバーの設定を取得する"""
-        return self.get_config().get("internal_mock_config", {"enabled": True, "port": 8001})
+    def get_internal_mock_config(self) -> Mapping[str, Any]:
+        """内蔵Pythonモックサーバーの設定を取得する (デフォルト値を適用済み、読み取り専用)"""
+        return self.get_config()[_K_MOCK]
 
     def is_internal_mock_enabled(self) -> bool:
-        return self.get_internal_mock_config().get("enabled", True)
+        return self._get("internal_mock_config.enabled", True)
 
     def get_internal_mock_port(self) -> int:
-        return self.get_internal_mock_config().get("port", 8001)
+        return self._get("internal_mock_config.port", 8001)
 
-    def get_mcp_servers_config(self) -> Dict[str, Dict[str, Any]]:
-        """ユーザー定義のMCPサーバー設定リストを取得する"""
-        return self.get_config().get("mcpServers", {})
+    def get_mcp_servers_config(self) -> Mapping[str, Mapping[str, Any]]:
+        """ユーザー定義のMCPサーバー設定リストを取得する (読み取り専用)"""
+        return self.get_config().get(_K_SERVERS, {})
 
-    def get_server_config(self, server_key: str) -> Optional[Dict[str, Any]]:
-        """指定されたキーのサーバー設定を取得する"""
+    def get_server_config(self, server_key: str) -> Optional[Mapping[str, Any]]:
+        """指定されたキーのサーバー設定を取得する (読み取り専用)"""
         return self.get_mcp_servers_config().get(server_key)
 
-    def get_server_config_by_key(self, server_key: str | None) -> Optional[Dict[str, Any]]:
+    def _server_config_from(self, config: Mapping[str, Any], server_key: str | None) -> Optional[Mapping[str, Any]]:
+        """
+        読み込み済みの config から指定されたキーのサーバー設定を取り出す.
+        結果は版数付きでキャッシュし、設定が変わるまでは同じオブジェクトを返す.
+        config には get_config() の戻り値 (現在の版数の設定) を渡すこと.
+        """
+        with self._lock:
+            cached = self._resolved_cache.get(server_key)
+            if cached is not None and cached[0] == self._version:
+                return cached[1]
+
+            resolved: Optional[Mapping[str, Any]]
+            if server_key == "internal_mock":
+                # internal_mock_config を返す (type を含む)
+                resolved = config[_K_MOCK]
+            elif server_key == "external":
+                # 外部URLの場合は特別な設定オブジェクトを返す (type を含む)
+                resolved = MappingProxyType({_K_TYPE: "sse", _K_URL: config[_K_EXTERNAL_URL]})
+            else:
+                # mcpServers から該当キーの設定を返す (見つからなければ None)
+                resolved = config[_K_SERVERS].get(server_key)
+            self._resolved_cache[server_key] = (self._version, resolved)
+            return resolved
+
+    def get_resolved_cwd(self, server_key: str) -> Optional[str]:
+        """
+        mcpServers のサーバーの cwd を絶対パスにして返す (未設定、または相対パスで存在しない場合は None).
+        設定の版数ごとに全サーバー分をまとめて解決するため、ディレクトリの確認は読み込み1回につき1度で済む.
+        """
+        with self._lock:
+            version = self.get_version()
+            if self._resolved_cwds is None or self._resolved_cwds[0] != version:
+                resolved: Dict[str, Optional[str]] = {}
+                for key, server_config in self.get_config()[_K_SERVERS].items():
+                    cwd = server_config.get(_K_CWD)
+                    if not cwd:
+                        resolved[key] = None
+                    elif os.path.isabs(cwd):
+                        resolved[key] = cwd
+                    else:  # 相対パスの場合 (main.py基準とする)
+                        absolute_cwd = os.path.abspath(cwd)
+                        resolved[key] = absolute_cwd if os.path.isdir(absolute_cwd) else None
+                self._resolved_cwds = (version, resolved)
+            return self._resolved_cwds[1].get(server_key)
+
+    def _resolve_active(self, config: Mapping[str, Any]) -> Tuple[str, Optional[Mapping[str, Any]]]:
+        """読み込み済みの config から、アクティブなサーバーのキーと設定を取り出す"""
+        active_key = config[_K_ACTIVE]
+        return active_key, self._server_config_from(config, active_key)
+
+    def get_server_config_by_key(self, server_key: str | None) -> Optional[Mapping[str, Any]]:
         """指定されたキーのサーバー設定を取得 (internal_mock, external, mcpServers を網羅)"""
-        config = self.get_config()
-        if server_key == "internal_mock":
-            # internal_mock_config を返す (type を含む)
-            return config.get("internal_mock_config")
-        elif server_key == "external":
-            # 外部URLの場合は特別な設定オブジェクトを返す (type を含む)
-            return {"type": "sse", "url": config.get("external_mcp_url")}
-        elif server_key in config.get("mcpServers", {}):
-            # mcpServers から該当キーの設定を返す
-            return config["mcpServers"].get(server_key)
-        else:
-            return None
+        return self._server_config_from(self.get_config(), server_key)
 
-    def get_active_server_config(self) -> Optional[Dict[str, Any]]:
+    def get_active_server_config(self) -> Optional[Mapping[str, Any]]:
         """現在アクティブなサーバーの設定情報を取得する"""
-        active_key = self.get_active_server_key()
-        return self.get_server_config_by_key(active_key)
+        return self._resolve_active(self.get_config())[1]
 
     def get_active_server_type(self) -> Optional[str]:
         """現在アクティブなサーバーのタイプ (sse or stdio) を取得する"""
-        active_config = self.get_active_server_config()
-        return active_config.get("type") if active_config else None
+        _, active_config = self._resolve_active(self.get_config())
+        return active_config.get(_K_TYPE) if active_config else None
 
     def get_active_mcp_url(self) -> Optional[str]:
         """現在アクティブなMCPサーバーのURLを取得する"""
-        config = self.get_config()
-        active_key = config.get("active_server_key")
-
-        active_config = self.get_server_config_by_key(active_key)
+        active_key, active_config = self._resolve_active(self.get_config())
         if not active_config:
-            print(f"警告: アクティブサーバーキー '{active_key}' の設定が見つかりません。")
+            if self._verbose:
+                print(f"警告: アクティブサーバーキー '{active_key}' の設定が見つかりません。")
             return None
 
-        server_type = active_config.get("type")
-        if server_type == "sse":
-            if active_key == "internal_mock":
-                mock_config = config.get("internal_mock_config", {})
-                port = mock_config.get("port", 8001)
-                return f"http://localhost:{port}/sse"
-            elif active_key == "external":
-                return config.get("external_mcp_url")
-            elif active_key in config.get("mcpServers", {}):
-                server_config = config["mcpServers"][active_key]
-                host = server_config.get("host", "localhost")
-                port = server_config.get("port")
-                if port:
-                    return f"http://{host}:{port}/sse"
-                else:
-                    print(f"警告: アクティブなサーバー '{active_key}' にポート番号が設定されていません。")
-                    return None
+        if active_config.get(_K_TYPE) != "sse":
+            return None  # stdio や他のタイプの場合は URL はない
+
+        if active_key == "internal_mock":
+            return f"http://localhost:{active_config['port']}/sse"
+        elif active_key == "external":
+            return active_config[_K_URL]
+        else:  # mcpServers のサーバー
+            host = active_config.get(_K_HOST, "localhost")
+            port = active_config.get(_K_PORT)
+            if port:
+                return f"http://{host}:{port}/sse"
             else:
-                print(f"警告: 不明なアクティブサーバーキー '{active_key}' です。")
-                return None  # 不明なキー or 未設定
-        else:  # stdio や他のタイプの場合は URL はない
-            return None
+                if self._verbose:
+                    print(f"警告: アクティブなサーバー '{active_key}' にポート番号が設定されていません。")
+                return None
+
+    def snapshot(self) -> ActiveSnapshot:
+        """
+        アクティブなサーバーのタイプ・URL・キー・設定をまとめて取得する.
+        設定の版数が変わるまでは同じスナップショットを返す.
+        """
+        with self._lock:
+            version = self.get_version()
+            if self._snapshot is not None and self._snapshot[0] == version:
+                return self._snapshot[1]
+            config = self.get_config()
+            active_key, active_config = self._resolve_active(config)
+            enabled = set()
+            if config[_K_MOCK].get(_K_ENABLED):
+                enabled.add("internal_mock")
+            # mcpServers の自動起動は未対応
+            # enabled.update(key for key, conf in config[_K_SERVERS].items() if conf.get(_K_ENABLED))
+            snap = ActiveSnapshot(
+                server_type=active_config.get(_K_TYPE) if active_config else None,
+                mcp_url=self.get_active_mcp_url(),
+                server_key=active_key,
+                server_config=active_config,
+                enabled_servers=frozenset(enabled),
+            )
+            self._snapshot = (version, snap)
+            return snap
 
-    def get_all_managed_servers(self) -> List[Tuple[str, Dict[str, Any]]]:
+    def get_entries(self) -> Mapping[str, ServerEntry]:
+        """
+        管理対象サーバー (内蔵モックとmcpServers) の設定を {server_key: ServerEntry} で返す (内蔵モックが先頭).
+        設定の版数が変わるまでは同じ結果を返す.
+        """
+        with self._lock:
+            version = self.get_version()
+            if self._entries is None or self._entries[0] != version:
+                entries: Dict[str, ServerEntry] = {}
+                for key, server_config in self.get_all_managed_servers():
+                    if not isinstance(server_config, Mapping):
+                        entries[key] = ServerEntry(enabled=False)
+                        continue
+                    entries[key] = ServerEntry(
+                        enabled=bool(server_config.get(_K_ENABLED, False)),
+                        command=server_config.get(_K_COMMAND),
+                        args=tuple(server_config.get(_K_ARGS) or ()),
+                        port=server_config.get(_K_PORT),
+                    )
+                self._entries = (version, entries)
+            return MappingProxyType(self._entries[1])
+
+    def get_entry(self, server_key: str) -> Optional[ServerEntry]:
+        """管理対象サーバーの設定を ServerEntry で返す (見つからなければ None)"""
+        return self.get_entries().get(server_key)
+
+    def set_enabled(self, enabled_by_key: Mapping[str, bool]) -> Optional[List[str]]:
+        """
+        管理対象サーバーの自動起動の有効/無効を {server_key: 有効か} でまとめて設定し、1回の書き込みで保存する.
+        実際に変わったキーの一覧を返す (変更がなければ書き込まない). 保存に失敗した場合は None を返す.
+        """
+        with self._lock:
+            config = self.load_config()  # 変更用のコピー
+            changed_keys = []
+            for server_key, enabled in enabled_by_key.items():
+                if server_key == "internal_mock":
+                    server_config = config[_K_MOCK]
+                elif server_key in config[_K_SERVERS]:
+                    server_config = config[_K_SERVERS][server_key]
+                else:
+                    continue
+                if server_config.get(_K_ENABLED, False) != enabled:
+                    server_config[_K_ENABLED] = enabled
+                    changed_keys.append(server_key)
+            if changed_keys and not self.save_config(config, merge_with_current=False):
+                return None
+            return changed_keys
+
+    def get_all_managed_servers(self) -> Iterator[Tuple[str, Mapping[str, Any]]]:
         """
         管理対象となる可能性のある全てのサーバー(内蔵モックとmcpServers)の
-        設定情報をリストで返す (キー, 設定辞書) のタプル。
+        設定情報を (キー, 設定辞書) のタプルで順に返すジェネレータ。
+        リストが必要な場合は呼び出し側で list() すること。
         enabled フラグは考慮しない。
         """
-        servers = []
+        config = self.get_config()
         # 内蔵モック
-        mock_config = self.get_internal_mock_config()
-        servers.append(("internal_mock", mock_config))
-
+        yield ("internal_mock", config[_K_MOCK])
         # ユーザー定義サーバー
-        user_servers = self.get_mcp_servers_config()
-        for key, conf in user_servers.items():
-            servers.append((key, conf))
-
-        return servers
+        yield from config[_K_SERVERS].items()
@@ -1,51 +1,88 @@
 import asyncio
+import contextlib
+import logging
 import os
 import signal
 import subprocess
 import sys
 import time
-from typing import Dict, List, Optional, Tuple
+import weakref
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
 
 import flet as ft
 
-from config_manager import ConfigManager
+from async_loop_thread import AsyncLoopThread
+from config_manager import ActiveSnapshot, ConfigManager
 from mcp_client import MCPClient
 from views.home_view import HomeView
 from views.settings_view import SettingsView
 from views.tool_view import ToolView
 
+log = logging.getLogger("mcp_agent")
+
+# 実行中に変わらないプラットフォーム依存の値
+_IS_WIN = sys.platform == "win32"
+# Windowsでは Ctrl+Break を送れるよう新しいプロセスグループで起動する
+_CREATION_FLAGS = subprocess.CREATE_NEW_PROCESS_GROUP if _IS_WIN else 0
+# 停止時に送るシグナル (Windowsはプロセスグループへの Ctrl+Break、Unix系はプロセスグループへの SIGTERM)
+_STOP_SIGNAL = signal.CTRL_BREAK_EVENT if _IS_WIN else signal.SIGTERM
+
 
 # --- サーバー管理クラス ---
 class ServerManager:
     def __init__(self, config_manager: ConfigManager):
         self.config_manager = config_manager
-        # サーバー名をキー、Popenオブジェクトを値とする辞書
-        self.server_processes: Dict[str, Optional[subprocess.Popen]] = {}
+        # サーバー名をキー、Processオブジェクトを値とする辞書
+        self.server_processes: Dict[str, Optional[asyncio.subprocess.Process]] = {}
+        # サーバー名をキー、実行中かどうかを値とする辞書 (プロセス終了時に監視タスクが更新する)
+        self._alive: Dict[str, bool] = {}
+        # プロセス終了を監視するタスク (GCされないよう参照を保持する)
+        self._watch_tasks: Set[asyncio.Task] = set()
         # サーバーごとの最終起動試行時刻
         self.last_start_attempt_times: Dict[str, float] = {}
         self.internal_mock_script = "mcp_server_mock.py"  # サーバー実行スクリプト名
         self.min_restart_interval = 5  # 最短再起動間隔(秒)
+        self.stderr_tail_lines = 20  # 起動失敗時に表示する標準エラー出力の行数
+        # 実行中に変わらない値は最初に一度だけ求めておく
+        self._python_executable = sys.executable
+        self._internal_mock_dir = os.path.dirname(os.path.abspath(self.internal_mock_script))
+        # 起動コマンドとCWDのキャッシュ (設定の版数が変わったら破棄する)
+        self._cmd_cache: Dict[str, Optional[Tuple[List[str], Optional[str]]]] = {}
+        self._cmd_cache_version = -1
+        # サーバーの終了や設定変更で即座に状態同期を行うためのイベント
+        self._sync_trigger = asyncio.Event()
+        # 最後に同期したときの設定の版数と、それ以降にサーバーの終了などで再同期が必要になったか
+        self._last_synced_version = -1
+        self._dirty = True
 
     def _get_server_command_and_cwd(self, server_key: str) -> Optional[Tuple[List[str], Optional[str]]]:
-        """指定されたサーバーキーに対応する起動コマンドとCWDを取得する"""
+        """指定されたサーバーキーに対応する起動コマンドとCWDを取得する (設定が変わるまではキャッシュを返す)"""
+        version = self.config_manager.get_version()
+        if version != self._cmd_cache_version:
+            self._cmd_cache.clear()
+            self._cmd_cache_version = version
+        if server_key not in self._cmd_cache:
+            self._cmd_cache[server_key] = self._build_server_command_and_cwd(server_key)
+        return self._cmd_cache[server_key]
+
+    def _build_server_command_and_cwd(self, server_key: str) -> Optional[Tuple[List[str], Optional[str]]]:
+        """指定されたサーバーキーに対応する起動コマンドとCWDを設定から組み立てる"""
         config = self.config_manager.get_config()
 
         if server_key == "internal_mock":
             mock_config = config.get("internal_mock_config", {})
             port = mock_config.get("port", 8001)
-            python_executable = sys.executable
-            script_path = os.path.abspath(self.internal_mock_script)
-            script_dir = os.path.dirname(script_path)
             # uvicorn を直接起動するコマンド
             command = [
-                python_executable,
+                self._python_executable,
                 self.internal_mock_script,
                 "--host",
                 "localhost",
                 "--port",
                 str(port),
             ]
-            return command, script_dir  # 内蔵モックはスクリプトのあるディレクトリをCWDとする
+            return command, self._internal_mock_dir  # 内蔵モックはスクリプトのあるディレクトリをCWDとする
         elif server_key in config.get("mcpServers", {}):
             server_config = config["mcpServers"][server_key]
             command_name = server_config.get("command")
@@ -53,7 +90,7 @@ class ServerManager:
             cwd = server_config.get("cwd")  # None の可能性あり
 
             if not command_name:
-                print(f"エラー: サーバー '{server_key}' に command が設定されていません。")
+                log.error("サーバー '%s' に command が設定されていません。", server_key)
                 return None
 
             # command が絶対パスか、PATHが通っている必要がある
@@ -61,24 +98,20 @@ class ServerManager:
 
             # cwd が相対パスの場合、config.jsonからの相対パス？ or main.pyから？
             # ここでは絶対パス指定を推奨とし、Noneなら Flet アプリの CWD を使う
-            absolute_cwd = None
-            if cwd and os.path.isabs(cwd):
-                absolute_cwd = cwd
-            elif cwd:  # 相対パスの場合 (main.py基準とする)
-                absolute_cwd = os.path.abspath(cwd)
-                if not os.path.isdir(absolute_cwd):
-                    print(f"警告: サーバー '{server_key}' のCWD '{cwd}' が見つかりません。デフォルトCWDを使用します。")
-                    absolute_cwd = None  # 見つからない場合はNoneに戻す
+            # (絶対パスへの変換と存在確認は ConfigManager が設定の読み込みごとに済ませている)
+            absolute_cwd = self.config_manager.get_resolved_cwd(server_key)
+            if cwd and absolute_cwd is None:
+                log.warning("サーバー '%s' のCWD '%s' が見つかりません。デフォルトCWDを使用します。", server_key, cwd)
 
             return full_command, absolute_cwd
         else:
-            print(f"エラー: 不明なサーバーキー '{server_key}' です。")
+            log.error("不明なサーバーキー '%s' です。", server_key)
             return None
 
     async def start_server(self, server_key: str) -> bool:
         """指定されたキーのサーバーを起動する"""
         if self.is_running(server_key):
-            # print(f"サーバー '{server_key}' は既に起動しています。")
+            # log.debug("サーバー '%s' は既に起動しています。", server_key)
             return True
 
         # --- 起動条件チェック ---
@@ -94,17 +127,19 @@ class ServerManager:
         #     should_be_enabled = server_config.get("enabled", False)
 
         if not server_config:
-            print(f"サーバー '{server_key}' の設定が見つかりません。")
+            log.warning("サーバー '%s' の設定が見つかりません。", server_key)
             return False
         if not should_be_enabled:
-            # print(f"サーバー '{server_key}' は設定で無効になっています。")
+            # log.debug("サーバー '%s' は設定で無効になっています。", server_key)
             return False  # 起動しない
 
         # 頻繁な再起動を防ぐ
         current_time = time.time()
         last_attempt = self.last_start_attempt_times.get(server_key, 0)
         if current_time - last_attempt < self.min_restart_interval:
-            print(f"サーバー '{server_key}' の再起動間隔が短すぎます。{self.min_restart_interval}秒待機します。")
+            log.warning(
+                "サーバー '%s' の再起動間隔が短すぎます。%s秒待機します。", server_key, self.min_restart_interval
+            )
             return False
         self.last_start_attempt_times[server_key] = current_time
 
@@ -114,131 +149,233 @@ class ServerManager:
             return False
         command, cwd = command_info
 
-        print(f"サーバー '{server_key}' を起動します: {' '.join(command)} (CWD: {cwd or os.getcwd()})")
+        if log.isEnabledFor(logging.INFO):  # コマンドの連結はログが有効な場合のみ行う
+            log.info("サーバー '%s' を起動します: %s (CWD: %s)", server_key, " ".join(command), cwd or os.getcwd())
         try:
             # shell=True はセキュリティリスクのため避ける
             # npx などは PATH が通っていれば直接実行できるはず
-            creationflags = subprocess.CREATE_NEW_PROCESS_GROUP if sys.platform == "win32" else 0
-            process = subprocess.Popen(
-                command,
+            process = await asyncio.create_subprocess_exec(
+                *command,
                 cwd=cwd,
-                # stdout=subprocess.PIPE, stderr=subprocess.PIPE, # ログをキャプチャする場合
-                creationflags=creationflags,
+                # 標準エラー出力は監視タスクが読み取ってログに流す
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                creationflags=_CREATION_FLAGS,
+                # Unix系では孫プロセスもまとめて止められるよう新しいプロセスグループで起動する
+                start_new_session=not _IS_WIN,
             )
             self.server_processes[server_key] = process
-            print(f"サーバー '{server_key}' プロセスを開始しました (PID: {process.pid})。")
-
-            # 起動確認 (簡易)
-            await asyncio.sleep(3)  # 起動待機時間 (サーバーによる)
-            if process.poll() is not None:
-                print(
-                    f"エラー: サーバー '{server_key}' プロセスが起動直後に終了しました (コード: {process.returncode})。"
+            self._alive[server_key] = True
+            stderr_tail: Deque[str] = deque(maxlen=self.stderr_tail_lines)
+            watch_task = asyncio.create_task(self._watch(server_key, process, stderr_tail))
+            self._watch_tasks.add(watch_task)
+            watch_task.add_done_callback(self._watch_tasks.discard)
+            log.info("サーバー '%s' プロセスを開始しました (PID: %s)。", server_key, process.pid)
+
+            # 起動確認: 内蔵モックはポートに接続できるまで短い間隔で確認する
+            port = server_config.get("port", 8001) if server_key == "internal_mock" else None
+            if not await self._wait_until_ready(process, port):
+                log.error(
+                    "サーバー '%s' プロセスが起動直後に終了しました (コード: %s)。", server_key, process.returncode
                 )
-                # ここで stderr を読み取って表示するとデバッグに役立つ
+                # 監視タスクが標準エラー出力を読み終えるのを少しだけ待ち、末尾をデバッグ用に表示する
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(asyncio.shield(watch_task), timeout=0.5)
+                if stderr_tail:
+                    log.error("サーバー '%s' の標準エラー出力 (末尾):\n%s", server_key, "\n".join(stderr_tail))
                 self.server_processes[server_key] = None
+                self._alive[server_key] = False
                 return False
             return True
         except FileNotFoundError:
-            print(f"エラー: コマンド '{command[0]}' が見つかりません。PATHを確認してください。")
+            log.error("コマンド '%s' が見つかりません。PATHを確認してください。", command[0])
             self.server_processes[server_key] = None
+            self._alive[server_key] = False
             return False
         except Exception as e:
-            print(f"サーバー '{server_key}' の起動中にエラーが発生しました: {e}")
+            log.error("サーバー '%s' の起動中にエラーが発生しました: %s", server_key, e)
+            self.server_processes[server_key] = None
+            self._alive[server_key] = False
+            return False
+
+    async def _watch(self, server_key: str, process: asyncio.subprocess.Process, stderr_tail: Deque[str]):
+        """
+        プロセスの標準エラー出力をログに流しながら終了を待ち、実行状態のキャッシュを更新する.
+        パイプが詰まってサーバーが止まらないよう、出力は終了まで読み続ける.
+        """
+        if process.stderr is not None:
+            # 行の途中やマルチバイト文字の途中で区切らないよう、1行ずつ読んでから行全体をデコードする
+            while True:
+                try:
+                    raw_line = await process.stderr.readline()
+                except ValueError:
+                    # バッファの上限 (64KiB) を超える長い行は、その行を読み捨てて次の行から続ける
+                    stderr_tail.append("(長すぎる行を省略しました)")
+                    continue
+                if not raw_line:
+                    break
+                line = raw_line.decode(errors="replace").rstrip("\r\n")
+                stderr_tail.append(line)
+                log.debug("[%s] %s", server_key, line)
+        await process.wait()
+        # 同じキーで別のプロセスが起動し直されている場合は触らない
+        if self.server_processes.get(server_key) is process:
+            self._alive[server_key] = False
             self.server_processes[server_key] = None
+            # 予期せず終了した可能性があるので、次の同期を待たずに状態を確認させる
+            self.request_sync()
+
+    def request_sync(self):
+        """状態同期ループに、待機時間を待たずに同期するよう要求する"""
+        self._dirty = True
+        self._sync_trigger.set()
+
+    async def wait_for_sync_request(self, timeout: float) -> bool:
+        """同期の要求があるか timeout 秒が経過するまで待つ. 要求があった場合は True を返す"""
+        try:
+            await asyncio.wait_for(self._sync_trigger.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
             return False
+        finally:
+            self._sync_trigger.clear()
+
+    async def _wait_until_ready(
+        self, process: asyncio.subprocess.Process, port: Optional[int], timeout: float = 3.0
+    ) -> bool:
+        """
+        起動したサーバーが接続を受け付けるまで待つ.
+        ポートに接続できた時点で True を返し、プロセスが終了した場合は False を返す.
+        timeout 秒以内に接続できなくても、プロセスが生きていれば起動済みとみなす.
+        """
+        if port is None:
+            # ポートが分からないサーバーは少しだけ待ってプロセスの生存のみ確認する
+            await asyncio.sleep(0.2)
+            return process.returncode is None
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection("localhost", port), timeout=0.1)
+                writer.close()
+                await writer.wait_closed()
+                return True
+            except (OSError, asyncio.TimeoutError):
+                if process.returncode is not None:
+                    return False
+                await asyncio.sleep(0.05)
+        return process.returncode is None
 
     async def stop_server(self, server_key: str):
         """指定されたキーのサーバープロセスを停止する"""
         process = self.server_processes.get(server_key)
-        if process and process.poll() is None:
-            print(f"サーバー '{server_key}' プロセス (PID: {process.pid}) を停止します...")
+        if process and process.returncode is None:
+            log.info("サーバー '%s' プロセス (PID: %s) を停止します...", server_key, process.pid)
             try:
                 # WindowsとUnix系でシグナルの送り方を使い分ける
-                if sys.platform == "win32":
+                if _IS_WIN:
                     # Ctrl+Breakシグナルをプロセスグループに送る
-                    process.send_signal(signal.CTRL_BREAK_EVENT)
+                    process.send_signal(_STOP_SIGNAL)
                 else:
-                    # プロセスグループにSIGTERMを送る (preexec_fn=os.setsidが必要な場合も)
-                    # ここではプロセス自体に送る
-                    process.terminate()
-
-                process.wait(timeout=5)
-                print(f"サーバー '{server_key}' プロセスが正常に停止しました。")
-            except subprocess.TimeoutExpired:
-                print(f"サーバー '{server_key}' が時間内に停止しませんでした。強制終了します。")
-                if sys.platform == "win32":
-                    subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], check=False, capture_output=True)
+                    # start_new_session=True で起動しているので、PIDがそのままプロセスグループIDになる
+                    self._signal_process_group(process, _STOP_SIGNAL)
+
+                await asyncio.wait_for(process.wait(), timeout=5)
+                log.info("サーバー '%s' プロセスが正常に停止しました。", server_key)
+            except asyncio.TimeoutError:
+                log.warning("サーバー '%s' が時間内に停止しませんでした。強制終了します。", server_key)
+                if _IS_WIN:
+                    # イベントループを止めないよう taskkill も非同期で実行する
+                    taskkill = await asyncio.create_subprocess_exec(
+                        "taskkill",
+                        "/F",
+                        "/T",
+                        "/PID",
+                        str(process.pid),
+                        stdout=asyncio.subprocess.DEVNULL,
+                        stderr=asyncio.subprocess.DEVNULL,
+                    )
+                    await taskkill.wait()
                 else:
-                    process.kill()
-                process.wait()
-                print(f"サーバー '{server_key}' プロセスを強制終了しました。")
+                    self._signal_process_group(process, signal.SIGKILL)
+                await process.wait()
+                log.warning("サーバー '%s' プロセスを強制終了しました。", server_key)
             except Exception as e:
-                print(f"サーバー '{server_key}' 停止中にエラーが発生しました: {e}")
+                log.error("サーバー '%s' 停止中にエラーが発生しました: %s", server_key, e)
             finally:
                 self.server_processes[server_key] = None
+                self._alive[server_key] = False
+
+    @staticmethod
+    def _signal_process_group(process: asyncio.subprocess.Process, sig: int):
+        """プロセスグループ全体にシグナルを送る (Unix系のみ)"""
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass  # 既に終了している
 
     async def stop_all_servers(self):
         """管理している全てのサーバープロセスを停止する"""
-        print("管理中の全サーバーを停止します...")
+        log.info("管理中の全サーバーを停止します...")
         # 並行して停止処理を行う
         tasks = [self.stop_server(key) for key in list(self.server_processes.keys())]
         await asyncio.gather(*tasks)
-        print("全サーバーの停止処理が完了しました。")
+        log.info("全サーバーの停止処理が完了しました。")
 
     def is_running(self, server_key: str) -> bool:
         """指定されたキーのサーバープロセスが実行中かどうかを確認する"""
         if server_key != "internal_mock":
             # internal_mock以外は常に実行中とみなす
             return True
-        process = self.server_processes.get(server_key)
-        return process is not None and process.poll() is None
+        return self._alive.get(server_key, False)
 
     def get_running_servers(self) -> List[str]:
         """現在実行中のサーバーキーのリストを返す"""
-        return [key for key, process in self.server_processes.items() if process and process.poll() is None]
+        return [key for key, alive in self._alive.items() if alive]
 
     async def restart_server(self, server_key: str) -> bool:
         """指定されたサーバーを再起動する"""
-        print(f"サーバー '{server_key}' を再起動します...")
+        log.info("サーバー '%s' を再起動します...", server_key)
+        # stop_server はプロセスの終了を待ってから戻るので、すぐに起動してよい
+        # (ポートの解放が遅れた場合も起動確認の待機中に再試行される)
         await self.stop_server(server_key)
-        await asyncio.sleep(1)  # 停止後少し待つ
         return await self.start_server(server_key)
 
     async def sync_server_states(self):
         """設定に基づいて、不要なサーバーを停止し、必要なサーバーを起動する"""
-        print("[Server Sync] サーバー状態を同期中...")
-        config = self.config_manager.get_config()
-        all_managed_keys = ["internal_mock", *list(config.get("mcpServers", {}).keys())]
-        start_tasks = []
-        stop_tasks = []
-
-        for key in all_managed_keys:
-            should_be_enabled = False
-            if key == "internal_mock":
-                should_be_enabled = config.get("internal_mock_config", {}).get("enabled", False)
-            # elif key in config.get("mcpServers", {}):
-            #     should_be_enabled = config["mcpServers"][key].get("enabled", False)
-
-            is_currently_running = self.is_running(key)
-
-            if should_be_enabled and not is_currently_running:
-                print(f"[Server Sync] サーバー '{key}' を起動する必要があります。")
-                start_tasks.append(self.start_server(key))  # 起動タスクを追加
-            elif not should_be_enabled and is_currently_running:
-                print(f"[Server Sync] サーバー '{key}' を停止する必要があります。")
-                stop_tasks.append(self.stop_server(key))  # 停止タスクを追加
-
-        # まず停止処理を並行実行
-        if stop_tasks:
-            await asyncio.gather(*stop_tasks)
-            await asyncio.sleep(1)  # 停止後少し待つ
-
-        # 次に起動処理を並行実行
-        if start_tasks:
-            results = await asyncio.gather(*start_tasks)
-            print(f"サーバー起動結果: {results}")
-
-        print("[Server Sync] サーバー状態の同期が完了しました。")
+        # 前回の同期以降、設定もサーバーの状態も変わっていなければ何もしない
+        version = self.config_manager.get_version()
+        if not self._dirty and version == self._last_synced_version:
+            return
+        # 同期中にサーバーが終了した場合は request_sync() で再び立つので、先に下ろしておく
+        self._dirty = False
+        log.debug("[Server Sync] サーバー状態を同期中...")
+        try:
+            # 有効なサーバーと実行中のサーバーの差分から、起動・停止するものを求める
+            enabled = self.config_manager.snapshot().enabled_servers
+            running = set(self.get_running_servers())
+            to_start = enabled - running
+            to_stop = running - enabled
+
+            # まず停止処理を並行実行 (stop_server はプロセスの終了を待ってから戻る)
+            if to_stop:
+                log.info("[Server Sync] サーバー %s を停止する必要があります。", sorted(to_stop))
+                await asyncio.gather(*(self.stop_server(key) for key in to_stop))
+
+            # 次に起動処理を並行実行
+            if to_start:
+                log.info("[Server Sync] サーバー %s を起動する必要があります。", sorted(to_start))
+                results = await asyncio.gather(*(self.start_server(key) for key in to_start))
+                log.info("サーバー起動結果: %s", results)
+                if not all(results):
+                    self._dirty = True  # 起動できなかったサーバーは次回もう一度試す
+        except BaseException:
+            self._dirty = True
+            raise
+        self._last_synced_version = version
+
+        log.debug("[Server Sync] サーバー状態の同期が完了しました。")
 
 
 # --- Flet アプリケーションメイン関数 ---
@@ -251,24 +388,65 @@ async def main(page: ft.Page):
     config_manager = ConfigManager()
     server_manager = ServerManager(config_manager)
     mcp_client = MCPClient()
+    # UIのイベントループを塞がずに通信を行うための専用ループ (接続テストなどで使う)
+    loop_thread = AsyncLoopThread()
+    loop_thread.start()
 
     # --- サーバー状態表示 ---
     server_status_summary = ft.Text("管理サーバー: 計算中...", size=10, tooltip="管理対象サーバーの実行状態")
     active_server_status = ft.Text("アクティブ: 計算中...", size=10, tooltip="現在接続中のサーバー状態")
+    # ステータスバーは一度だけ作り、表示中のViewのAppBarに付け替えて使い回す
+    status_bar_content = ft.Row(
+        [active_server_status, ft.VerticalDivider(width=10), server_status_summary],
+        spacing=5,
+        alignment=ft.MainAxisAlignment.END,
+    )
+    status_container = ft.Container(
+        content=status_bar_content,
+        padding=ft.padding.only(right=10),
+        tooltip=f"{active_server_status.tooltip} | {server_status_summary.tooltip}",
+        data="status_bar",
+    )
+    # ステータスバーを追加済みのAppBar (Viewが破棄されれば自動的に消える)
+    appbars_with_status_bar: "weakref.WeakSet[ft.AppBar]" = weakref.WeakSet()
+
+    def attach_status_bar(view: Optional[ft.View]):
+        """ViewのAppBarに共有のステータスバーを追加する (追加済みなら何もしない)"""
+        if view is None or not isinstance(view.appbar, ft.AppBar):
+            return
+        appbar = view.appbar
+        if appbar in appbars_with_status_bar:
+            return
+        if appbar.actions is None:
+            appbar.actions = []
+        appbar.actions.append(status_container)
+        appbars_with_status_bar.add(appbar)
+
+    # defer_updates() のネストの深さ。0 より大きい間は page.update() を後回しにする
+    update_depth = 0
+
+    @contextlib.contextmanager
+    def defer_updates():
+        """ブロック内の page.update() を抑え、抜けるときに一度だけ反映する"""
+        nonlocal update_depth
+        update_depth += 1
+        try:
+            yield
+        finally:
+            update_depth -= 1
+            if update_depth == 0:
+                page.update()
 
     async def update_server_status_ui():
         """UI上のサーバー状態表示を更新"""
-        config = config_manager.get_config()
-        enabled_servers = []
-        if config.get("internal_mock_config", {}).get("enabled"):
-            enabled_servers.append("internal_mock")
-        # for key, conf in config.get("mcpServers", {}).items():
-        #     if conf.get("enabled"):
-        #         enabled_servers.append(key)
+        enabled_servers = config_manager.snapshot().enabled_servers
+
+        # 表示内容が変わらなければ page.update() を省略するため、更新前の値を控えておく
+        prev = (server_status_summary.value, active_server_status.value, active_server_status.tooltip)
 
         num_enabled = len(enabled_servers)
-        running_servers = server_manager.get_running_servers()
-        num_running = len([s for s in running_servers if s in enabled_servers])  # 有効なサーバーのうち実行中のもの
+        # 有効なサーバーのうち実行中のもの
+        num_running = len(enabled_servers.intersection(server_manager.get_running_servers()))
 
         server_status_summary.value = f"管理サーバー: {num_running}/{num_enabled} 実行中"
 
@@ -295,149 +473,163 @@ async def main(page: ft.Page):
 
         active_server_status.value = f"アクティブ: {active_key} ({active_status_str})"
         active_server_status.tooltip = active_tooltip
+        status_container.tooltip = f"{active_tooltip} | {server_status_summary.tooltip}"
+
+        if prev == (server_status_summary.value, active_server_status.value, active_server_status.tooltip):
+            return  # 表示に変化がない
+        if update_depth:
+            return  # defer_updates() の終了時にまとめて反映される
 
         try:
             if page.controls or page.views:  # ページが描画されているか確認
                 page.update()
         except Exception as e:
-            print(f"サーバー状態UIの更新中にエラー: {e}")  # UI更新失敗は無視して継続
+            log.warning("サーバー状態UIの更新中にエラー: %s", e)  # UI更新失敗は無視して継続
 
     # --- サーバー自動起動・状態監視 ---
+    async def sync_and_refresh():
+        """サーバーの状態を設定と同期し、UIを更新する"""
+        log.debug("[Server Check] 実行中: サーバー状態の同期チェック...")
+        try:
+            # 設定に基づいてサーバーを起動/停止
+            await server_manager.sync_server_states()
+            # UI表示を更新
+            await update_server_status_ui()
+        except Exception as e:
+            log.error("[Server Check] サーバーチェックループでエラー: %s", e)
+            # エラーが発生してもループは継続する
+
     async def server_check_loop():
-        """定期的にサーバーの状態を設定と同期し、UIを更新する"""
+        """定期的にサーバーの状態を設定と同期し、UIを更新する (初回の同期は起動処理で行う)"""
         while True:
-            print("[Server Check] 実行中: サーバー状態の同期チェック...")
-            try:
-                # 設定に基づいてサーバーを起動/停止
-                await server_manager.sync_server_states()
-                # UI表示を更新
-                await update_server_status_ui()
-            except Exception as e:
-                print(f"[Server Check] サーバーチェックループでエラー: {e}")
-                # エラーが発生してもループは継続する
-            await asyncio.sleep(30)  # 30秒ごとにチェック (同期処理があるので少し長め)
+            # サーバーの終了や設定変更で同期が要求されるまで待つ (要求がなくても60秒ごとにチェック)
+            await server_manager.wait_for_sync_request(timeout=60.0)
+            await sync_and_refresh()
 
     # --- アプリ終了時の処理 ---
     async def on_disconnect(e):
-        print("アプリケーションが切断されました。管理中の全サーバーを停止します。")
+        log.info("アプリケーションが切断されました。管理中の全サーバーを停止します。")
+        await close_stale_sessions()
         if mcp_client.session is not None:
             try:
                 await mcp_client.aclose()
             except Exception:
-                print("MCPClientのクローズ中にエラーが発生しました。")
+                log.warning("MCPClientのクローズ中にエラーが発生しました。")
         await server_manager.stop_all_servers()  # 全サーバー停止に変更
+        loop_thread.stop()
 
     page.on_disconnect = on_disconnect  # Flet 0.21.0 以降
 
-    async def update_mcp_client(route: str):
-        nonlocal mcp_client
-        active_server_type = config_manager.get_active_server_type()
-        if active_server_type == "sse":
-            active_mcp_url = config_manager.get_active_mcp_url()
-            assert active_mcp_url is not None, "MCP URL must be set for SSE server type"
-            print(f"MCPClientの接続先を更新: {mcp_client.server_command_or_server_url} -> {active_mcp_url}")
-            print(f"MCPClient.sessionの状態: {mcp_client.session}")
-            if mcp_client.session is None:
-                await mcp_client.connect_to_server(
-                    server_type=active_server_type, server_command_or_server_url=active_mcp_url
-                )
-                print("MCPClient接続完了")
-            elif route == "/settings":
-                pass  # 設定画面への遷移では接続先を変更しない
-            else:
-                try:
-                    await mcp_client.aclose()
-                except Exception:
-                    print("MCPClientのクローズ中にエラーが発生しました。")
-                await mcp_client.connect_to_server(
-                    server_type=active_server_type, server_command_or_server_url=active_mcp_url
+    # 接続先の切り替えで不要になった古い接続 (画面の表示が終わってから閉じる)
+    stale_exit_stacks: List[contextlib.AsyncExitStack] = []
+
+    async def close_stale_sessions():
+        """切り替え前の古い接続を閉じる"""
+        while stale_exit_stacks:
+            try:
+                await stale_exit_stacks.pop().aclose()
+            except Exception:
+                log.warning("MCPClientのクローズ中にエラーが発生しました。")
+
+    async def _do_connect(snap: ActiveSnapshot):
+        """スナップショットが示すアクティブなサーバーに MCPClient を接続する (接続中なら新しい接続と入れ替える)"""
+        old_stack = None
+        if snap.server_type == "sse":
+            assert snap.mcp_url is not None, "MCP URL must be set for SSE server type"
+            old_stack = await mcp_client.replace_session(
+                server_type=snap.server_type, server_command_or_server_url=snap.mcp_url
+            )
+            log.info("MCPClient接続完了")
+        elif snap.server_type == "stdio":
+            if not snap.server_config:
+                log.error("サーバー '%s' の設定が見つかりません。", snap.server_key)
+                return
+            server_command = snap.server_config.get("command", None)
+            if server_command:
+                old_stack = await mcp_client.replace_session(
+                    server_type=snap.server_type,
+                    server_command_or_server_url=server_command,
+                    # 設定は読み取り専用のビュー (タプル・MappingProxyType) なので、通常のリスト・辞書にして渡す
+                    stdio_args=list(snap.server_config.get("args", [])),
+                    stdio_env=dict(snap.server_config.get("env", {})),
+                    stdio_cwd=snap.server_config.get("cwd", None),
+                    stdio_server_key=snap.server_key,
                 )
-                print("MCPClient接続完了")
-        elif active_server_type == "stdio":
-            active_server_key = config_manager.get_active_server_key()
-            active_server_config = config_manager.get_server_config(active_server_key)
-            assert active_server_key is not None, "MCP Server Key must be set for STDIO server type"
-            print(f"MCPClientの接続先を更新: {mcp_client.stdio_server_key} -> {active_server_key}")
-            print(f"MCPClient.sessionの状態: {mcp_client.session}")
-            if mcp_client.session is None:
-                if active_server_config:
-                    server_command = active_server_config.get("command", None)
-                    stdio_args = active_server_config.get("args", [])
-                    stdio_env = active_server_config.get("env", {})
-                    stdio_cwd = active_server_config.get("cwd", None)
-                    if server_command:
-                        await mcp_client.connect_to_server(
-                            server_type=active_server_type,
-                            server_command_or_server_url=server_command,
-                            stdio_args=stdio_args,
-                            stdio_env=stdio_env,
-                            stdio_cwd=stdio_cwd,
-                            stdio_server_key=active_server_key,
-                        )
-                        print("MCPClient接続完了")
-                else:
-                    print(f"エラー: サーバー '{active_server_key}' の設定が見つかりません。")
-            elif route == "/settings":
-                pass  # 設定画面への遷移では接続先を変更しない
-            else:
-                try:
-                    await mcp_client.aclose()
-                except Exception:
-                    print("MCPClientのクローズ中にエラーが発生しました。")
-                if active_server_config:
-                    server_command = active_server_config.get("command", None)
-                    stdio_args = active_server_config.get("args", [])
-                    stdio_env = active_server_config.get("env", {})
-                    stdio_cwd = active_server_config.get("cwd", None)
-                    if server_command:
-                        await mcp_client.connect_to_server(
-                            server_type=active_server_type,
-                            server_command_or_server_url=server_command,
-                            stdio_args=stdio_args,
-                            stdio_env=stdio_env,
-                            stdio_cwd=stdio_cwd,
-                            stdio_server_key=active_server_key,
-                        )
-                        print("MCPClient接続完了")
-                else:
-                    print(f"エラー: サーバー '{active_server_key}' の設定が見つかりません。")
+                log.info("MCPClient接続完了")
+        if old_stack is not None:
+            stale_exit_stacks.append(old_stack)
+
+    async def update_mcp_client(route: str, snap: ActiveSnapshot):
+        if snap.server_type == "sse":
+            assert snap.mcp_url is not None, "MCP URL must be set for SSE server type"
+            if (
+                mcp_client.session is not None
+                and mcp_client.server_type == "sse"
+                and mcp_client.server_command_or_server_url == snap.mcp_url
+            ):
+                return  # 接続先が変わっていなければ張り直さない
+            log.info("MCPClientの接続先を更新: %s -> %s", mcp_client.server_command_or_server_url, snap.mcp_url)
+        elif snap.server_type == "stdio":
+            assert snap.server_key is not None, "MCP Server Key must be set for STDIO server type"
+            if (
+                mcp_client.session is not None
+                and mcp_client.server_type == "stdio"
+                and mcp_client.stdio_server_key == snap.server_key
+            ):
+                return  # 接続先が変わっていなければ張り直さない
+            log.info("MCPClientの接続先を更新: %s -> %s", mcp_client.stdio_server_key, snap.server_key)
         else:
-            print(f"無効なサーバータイプ: {active_server_type}")
+            log.error("無効なサーバータイプ: %s", snap.server_type)
+            return
+        log.debug("MCPClient.sessionの状態: %s", mcp_client.session)
+
+        if mcp_client.session is not None and route == "/settings":
+            return  # 設定画面への遷移では接続先を変更しない
+        # 古い接続は新しい接続が確立してから入れ替え、閉じるのは画面の表示後に回す
+        await _do_connect(snap)
 
     # --- ルーティング処理 ---
     async def route_change(route: ft.RouteChangeEvent):
-        print(f"Route change to: {route.route}")
-        # ルート変更時にクライアントを最新のアクティブ設定に更新
-        active_server_type = config_manager.get_active_server_type()
+        log.debug("Route change to: %s", route.route)
+        previous_views = list(page.views)
+        # 画面の組み立て中の更新はまとめて、最後に一度だけ page.update() する
+        with defer_updates():
+            await render_route(route)
+        # 画面を表示し終えてから、切り替え前の古い接続と、閉じた設定画面の接続テスト用の接続を閉じる
+        await close_stale_sessions()
+        for view in previous_views:
+            if view in page.views:
+                continue
+            if isinstance(view, SettingsView):
+                await view.close_probe()
+            elif isinstance(view, ToolView):
+                view.cancel_pending_validation()  # 閉じた画面の入力欄を更新しないようにする
+
+    async def render_route(route: ft.RouteChangeEvent):
+        """ルートに対応するViewを組み立てる"""
+        # ルート変更時にクライアントを最新のアクティブ設定に更新 (設定は一度だけまとめて取得する)
+        snap = config_manager.snapshot()
+        active_server_type = snap.server_type
         if active_server_type and (mcp_client.server_type != active_server_type):
-            await update_mcp_client(route.route)
+            await update_mcp_client(route.route, snap)
         else:
             if active_server_type == "sse":
-                active_mcp_url = config_manager.get_active_mcp_url()
-                if active_mcp_url and mcp_client.server_command_or_server_url != active_mcp_url:
+                if snap.mcp_url and mcp_client.server_command_or_server_url != snap.mcp_url:
                     # URLが変更された場合のみ接続先を更新
-                    await update_mcp_client(route.route)
+                    await update_mcp_client(route.route, snap)
             elif active_server_type == "stdio":
-                active_server_key = config_manager.get_active_server_key()
-                if active_server_key and mcp_client.stdio_server_key != active_server_key:
+                if snap.server_key and mcp_client.stdio_server_key != snap.server_key:
                     # サーバーキーが変更された場合のみ接続先を更新
-                    await update_mcp_client(route.route)
+                    await update_mcp_client(route.route, snap)
             else:
-                print(f"無効なサーバータイプ: {active_server_type}")
+                log.error("無効なサーバータイプ: %s", active_server_type)
 
         page.views.clear()
 
-        # --- ステータスバー表示用のコンテナ ---
-        status_bar_content = ft.Row(
-            [active_server_status, ft.VerticalDivider(width=10), server_status_summary],
-            spacing=5,
-            alignment=ft.MainAxisAlignment.END,
-        )
-
         # --- 各ルートに対応するViewを生成 ---
         current_view = None
         if route.route == "/settings":
-            settings_view = SettingsView(page, config_manager, mcp_client, server_manager)
+            settings_view = SettingsView(page, config_manager, mcp_client, server_manager, loop_thread)
             page.views.append(settings_view)
             current_view = settings_view
         elif route.route.startswith("/tool/"):
@@ -462,79 +654,32 @@ async def main(page: ft.Page):
                 home_view.status_text.visible = True
 
         # --- AppBarにステータスバーを追加 ---
-        if current_view and current_view.appbar and isinstance(current_view.appbar, ft.AppBar):
-            if current_view.appbar.actions is None:
-                current_view.appbar.actions = []
-            # 重複追加を防ぐ
-            if not any(
-                isinstance(action, ft.Container) and action.data == "status_bar"
-                for action in current_view.appbar.actions
-            ):
-                status_container = ft.Container(
-                    content=status_bar_content,
-                    padding=ft.padding.only(right=10),
-                    tooltip=f"{active_server_status.tooltip} | {server_status_summary.tooltip}",
-                    data="status_bar",
-                )
-                current_view.appbar.actions.append(status_container)
+        attach_status_bar(current_view)
 
         # --- 有効なURLがない場合のリダイレクト ---
         # (外部URLがアクティブだが空、またはアクティブキーが無効な場合など)
         # mcp_client.base_url が None かどうかで判定
         if not mcp_client.session and route.route != "/settings":
-            print(
-                "有効なMCP URLが見つからないため /settings へリダイレクトします"
-                + f" (現在のキー: {config_manager.get_active_server_key()})。"
+            log.info(
+                "有効なMCP URLが見つからないため /settings へリダイレクトします (現在のキー: %s)。", snap.server_key
             )
             # SettingsViewを表示するように切り替え
             page.views.clear()
-            settings_view = SettingsView(page, config_manager, mcp_client, server_manager)
+            settings_view = SettingsView(page, config_manager, mcp_client, server_manager, loop_thread)
             page.views.append(settings_view)
             # ステータスバーも追加
-            if settings_view.appbar and isinstance(settings_view.appbar, ft.AppBar):
-                if settings_view.appbar.actions is None:
-                    settings_view.appbar.actions = []
-                status_container = ft.Container(
-                    content=status_bar_content,
-                    padding=ft.padding.only(right=10),
-                    tooltip=f"{active_server_status.tooltip} | {server_status_summary.tooltip}",
-                    data="status_bar",
-                )
-                settings_view.appbar.actions.append(status_container)
+            attach_status_bar(settings_view)
 
         await update_server_status_ui()  # UIの状態を最新にする
-        page.update()
 
     # --- View Pop処理 ---
     async def view_pop(view: ft.ViewPopEvent):
         page.views.pop()
         top_view_route = page.views[-1].route if page.views else "/"
 
-        # Pop後のViewにもステータスバーを（念のため）追加/更新
+        # Pop後のViewにもステータスバーを（念のため）追加
         if page.views:
-            current_view = page.views[-1]
-            if current_view.appbar and isinstance(current_view.appbar, ft.AppBar):
-                status_bar_content = ft.Row(
-                    [active_server_status, ft.VerticalDivider(width=10), server_status_summary],
-                    spacing=5,
-                    alignment=ft.MainAxisAlignment.END,
-                )
-                status_container = ft.Container(
-                    content=status_bar_content,
-                    padding=ft.padding.only(right=10),
-                    tooltip=f"{active_server_status.tooltip} | {server_status_summary.tooltip}",
-                    data="status_bar",
-                )
-                # 既存のアクションからstatus_barを削除して新しいものを追加
-                if current_view.appbar.actions:
-                    current_view.appbar.actions = [
-                        a
-                        for a in current_view.appbar.actions
-                        if not (isinstance(a, ft.Container) and a.data == "status_bar")
-                    ]
-                else:
-                    current_view.appbar.actions = []
-                current_view.appbar.actions.append(status_container)
+            attach_status_bar(page.views[-1])
 
         page.go(top_view_route)  # type: ignore # go を呼ぶと route_change がトリガーされる
 
@@ -543,7 +688,7 @@ async def main(page: ft.Page):
     page.on_view_pop = view_pop
 
     # --- アプリケーション開始時の処理 ---
-    print("アプリケーション起動、初期設定とサーバーチェックを開始します...")
+    log.info("アプリケーション起動、初期設定とサーバーチェックを開始します...")
 
     # サーバー状態監視ループをバックグラウンドで開始
     _ = asyncio.create_task(server_check_loop())  # noqa: RUF006
@@ -551,12 +696,17 @@ async def main(page: ft.Page):
     # ページが表示される前に一度状態を更新しておく
     await update_server_status_ui()
 
-    # 初期ルートへの遷移
+    # 初回のサーバー同期 (サーバー起動) と初期ルートへの遷移 (MCP接続) を並行して行う
+    first_sync = asyncio.create_task(sync_and_refresh())
     page.go("/")
+    await first_sync
 
 
 # --- アプリケーションの実行 ---
 if __name__ == "__main__":
+    # ログレベルは環境変数 LOG_LEVEL で指定する (例: LOG_LEVEL=INFO)
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper())
+
     # uvicorn サーバーが Windows で Ctrl+C を正しくハンドルするために必要
     # if sys.platform == "win32":
     #     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
@@ -1,22 +1,31 @@
 import asyncio
+import time
 from contextlib import AsyncExitStack
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Optional
 
 from mcp import ClientSession, StdioServerParameters, Tool
 from mcp.client.sse import sse_client
 from mcp.client.stdio import stdio_client
+from mcp.shared.session import ProgressFnT
 from mcp.types import CallToolResult
 
 
 class MCPClient:
     """MCPサーバーとの非同期通信を行うクライアント"""
 
+    # ツール一覧のキャッシュの有効期間(秒)
+    TOOLS_CACHE_TTL = 10.0
+
     def __init__(self):
         self.session: Optional[ClientSession] = None
         self.server_type: Optional[str] = None
         self.server_command_or_server_url: Optional[str] = None
         self.stdio_server_key: Optional[str] = None
         self.exit_stack = AsyncExitStack()
+        # (取得時刻, ツール一覧)。接続先が変わるか TTL を過ぎるまで使い回す
+        self._tools_cache: Optional[tuple[float, list[Tool]]] = None
+        # replace_session による接続の入れ替えを直列化するためのロック
+        self._replace_lock = asyncio.Lock()
 
     async def connect_to_server(
         self,
@@ -27,6 +36,7 @@ class MCPClient:
         stdio_cwd: Optional[str] = None,
         stdio_server_key: Optional[str] = None,
     ):
+        self.invalidate_tools()
         match server_type:
             case "stdio":
                 server_params = StdioServerParameters(
@@ -48,28 +58,170 @@ class MCPClient:
                 self.server_type = server_type
                 self.server_command_or_server_url = server_command_or_server_url
 
+    async def replace_session(
+        self,
+        server_type: str,
+        server_command_or_server_url: str,
+        stdio_args: Optional[list[str]] = None,
+        stdio_env: Optional[dict[str, str]] = None,
+        stdio_cwd: Optional[str] = None,
+        stdio_server_key: Optional[str] = None,
+    ) -> Optional[AsyncExitStack]:
+        """
+        新しい接続先に接続してからセッションを入れ替える.
+        古い接続は閉じずにその AsyncExitStack を返すので、呼び出し側で都合のよいときに aclose() すること.
+        接続していなかった場合は None を返す.
+        """
+        async with self._replace_lock:
+            old_stack = self.exit_stack if self.session is not None else None
+            if old_stack is not None:
+                self.exit_stack = AsyncExitStack()
+            try:
+                await self.connect_to_server(
+                    server_type,
+                    server_command_or_server_url,
+                    stdio_args=stdio_args,
+                    stdio_env=stdio_env,
+                    stdio_cwd=stdio_cwd,
+                    stdio_server_key=stdio_server_key,
+                )
+            except BaseException:
+                # 新しい接続に失敗した場合は、途中まで開いたものと古い接続の両方を閉じる
+                await self.aclose()
+                if old_stack is not None:
+                    await old_stack.aclose()
+                raise
+            return old_stack
+
     async def get_tools(self) -> list[Tool]:
         """MCPサーバーから利用可能なツールのリストを取得する"""
         if self.session is None:
             raise ValueError("MCPサーバーに接続されていません。")
-        response = await self.session.list_tools()
-        tools = response.tools
-        if not isinstance(tools, list):
-            raise ValueError("ツールリストのレスポンス形式が不正です (リストではありません)。")
-        return tools
-
-    async def run_tool(self, tool_name: str, tool_args: dict[str, Any]) -> CallToolResult:
-        """指定されたツールをMCPサーバー上で実行する"""
+        if self._tools_cache is not None and time.monotonic() - self._tools_cache[0] < self.TOOLS_CACHE_TTL:
+            return self._tools_cache[1]
+        return [tool async for tool in self.iter_tools()]
+
+    async def iter_tools(self) -> AsyncIterator[Tool]:
+        """
+        MCPサーバーから利用可能なツールを受け取った順に1つずつ返す.
+        サーバーがツール一覧をページに分けて返す場合は、次のページを待たずに受け取った分から返す.
+        最後まで取得できた一覧はキャッシュし、TTL の間は get_tools と同じくそれを返す.
+        """
+        session = self.session
+        if session is None:
+            raise ValueError("MCPサーバーに接続されていません。")
+        if self._tools_cache is not None and time.monotonic() - self._tools_cache[0] < self.TOOLS_CACHE_TTL:
+            for tool in self._tools_cache[1]:
+                yield tool
+            return
+
+        tools: list[Tool] = []
+        cursor: Optional[str] = None
+        while True:
+            response = await session.list_tools(cursor=cursor)
+            # レスポンスの型チェックは開発時のみ行う (python -O では省略される)
+            if __debug__ and not isinstance(response.tools, list):
+                raise ValueError("ツールリストのレスポンス形式が不正です (リストではありません)。")
+            for tool in response.tools:
+                tools.append(tool)
+                yield tool
+            cursor = response.nextCursor
+            if not cursor:
+                break
+        # 取得中に接続先が変わっていなければキャッシュする
+        if session is self.session:
+            self._tools_cache = (time.monotonic(), tools)
+
+    def invalidate_tools(self):
+        """ツール一覧のキャッシュを破棄し、次の get_tools でサーバーから取得し直させる"""
+        self._tools_cache = None
+
+    async def run_tool(
+        self, tool_name: str, tool_args: dict[str, Any], progress_callback: Optional[ProgressFnT] = None
+    ) -> CallToolResult:
+        """
+        指定されたツールをMCPサーバー上で実行する.
+        progress_callback を渡すと、サーバーから進捗通知が届くたびに (progress, total, message) で呼ばれる.
+        """
         if self.session is None:
             raise ValueError("MCPサーバーに接続されていません。")
-        result = await self.session.call_tool(tool_name, tool_args)
-        if not isinstance(result, CallToolResult):
+        result = await self.session.call_tool(tool_name, tool_args, progress_callback=progress_callback)
+        if __debug__ and not isinstance(result, CallToolResult):
             raise ValueError("ツール実行結果のレスポンス形式が不正です (辞書ではありません)。")
         return result
 
     async def aclose(self):
         """Clean up resources"""
-        await self.exit_stack.aclose()
+        self.invalidate_tools()
+        # 閉じたスタックを使い回さず、次の接続用に新しいスタックを用意する
+        exit_stack, self.exit_stack = self.exit_stack, AsyncExitStack()
+        self.session = None
+        await exit_stack.aclose()
+
+
+class ConnectionProbe:
+    """
+    接続テスト用に、同じURLへの接続を保持して使い回すクライアント.
+    接続と切断は同じタスクで行う必要があるため (anyio のキャンセルスコープの制約)、
+    接続を持ち続けるタスクを立ち上げ、ツール一覧の取得はキューを通して依頼する.
+    count_tools と aclose は常に同じイベントループから呼ぶこと.
+    """
+
+    def __init__(self):
+        self.url: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        # 接続を持つタスクへの依頼 (結果を返す Future。None は終了の合図)
+        self._requests: asyncio.Queue[Optional[asyncio.Future[int]]] = asyncio.Queue()
+
+    async def count_tools(self, url: str) -> int:
+        """url のSSEサーバーに接続し (同じURLなら既存の接続を使い)、見つかったツールの数を返す"""
+        if self._task is None or self._task.done() or url != self.url:
+            await self.aclose()
+            self.url = url
+            self._requests = asyncio.Queue()
+            self._task = asyncio.create_task(self._serve(url, self._requests))
+        future: asyncio.Future[int] = asyncio.get_running_loop().create_future()
+        self._requests.put_nowait(future)
+        return await future
+
+    @staticmethod
+    async def _serve(url: str, requests: "asyncio.Queue[Optional[asyncio.Future[int]]]"):
+        """接続を開き、終了の合図か通信エラーまで依頼に応えてから、同じタスクで接続を閉じる"""
+        client = MCPClient()
+        try:
+            await client.connect_to_server(server_type="sse", server_command_or_server_url=url)
+            while (future := await requests.get()) is not None:
+                # 接続テストなので、キャッシュではなく毎回サーバーに問い合わせる
+                client.invalidate_tools()
+                try:
+                    tools = await client.get_tools()
+                except Exception as ex:
+                    # 接続が切れている可能性があるため、このタスクは終了して次の依頼で接続し直す
+                    future.set_exception(ex)
+                    raise
+                future.set_result(len(tools))
+        except BaseException as ex:
+            # 応えられなかった依頼にはエラーを返す
+            while not requests.empty():
+                pending = requests.get_nowait()
+                if pending is not None and not pending.done():
+                    if isinstance(ex, Exception):
+                        pending.set_exception(ex)
+                    else:
+                        pending.cancel()
+            if not isinstance(ex, Exception):
+                raise
+        finally:
+            await client.aclose()
+
+    async def aclose(self):
+        """保持している接続を閉じる"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        if not task.done():
+            self._requests.put_nowait(None)
+        await asyncio.gather(task, return_exceptions=True)
 
 
 async def test():
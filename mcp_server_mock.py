@@ -1,66 +1,171 @@
 import asyncio
+import contextlib
+import importlib.util
+import itertools
+import math
+import os
 import random
+import sys
+from typing import TYPE_CHECKING, AsyncIterator
 
-import uvicorn
-from mcp.server import Server
+import anyio
+import anyio.lowlevel
+from anyio.streams.memory import MemoryObjectSendStream
 from mcp.server.fastmcp import FastMCP
-from mcp.server.sse import SseServerTransport
-from starlette.applications import Starlette
-from starlette.requests import Request
-from starlette.routing import Mount, Route
+
+if TYPE_CHECKING:
+    # サーバーとして起動するときだけ必要なモジュールは、型チェック時以外は使う場所でインポートする
+    from mcp.server import Server
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.types import Receive, Scope, Send
 
 # Initialize FastMCP server
 mcp = FastMCP("mock_server")
 
 
+def _parse_mock_delay(value: str | None) -> float | None:
+    """Parse MOCK_DELAY_MS (milliseconds) into seconds. Invalid values are ignored with a warning."""
+    if not value:
+        return None
+    try:
+        delay_ms = float(value)
+    except ValueError:
+        delay_ms = math.nan
+    if not (math.isfinite(delay_ms) and delay_ms >= 0):  # 数値でない値・負の値・inf は無視する
+        print(f"警告: MOCK_DELAY_MS={value!r} は0以上の数値ではないため無視します。", file=sys.stderr)
+        return None
+    return delay_ms / 1000
+
+
+# 環境変数 MOCK_DELAY_MS が設定されていれば、各ツールの遅延をその固定値 (ミリ秒) にする (0 で遅延なし)
+MOCK_DELAY: float | None = _parse_mock_delay(os.environ.get("MOCK_DELAY_MS"))
+
+# web_search のダミー結果のテンプレート (番号は埋め込み済み、{query} だけを呼び出しごとに埋める)
+_RESULT_TEMPLATES: list[tuple[str, str, str]] = []
+
+
+def _result_templates(num: int) -> list[tuple[str, str, str]]:
+    """Return the first num result templates, building any that are missing."""
+    for i in range(len(_RESULT_TEMPLATES) + 1, num + 1):
+        _RESULT_TEMPLATES.append(
+            (
+                f"Mock Result {i} for '{{query}}'",
+                f"http://example.com/search?q={{query}}&page={i}",
+                f"This is a dummy snippet for result {i} about {{query}}.",
+            )
+        )
+    return _RESULT_TEMPLATES[:num]
+
+
+_result_templates(50)
+
+
+# 遅延の計算に使う 0〜1 の乱数をあらかじめ作っておき、呼び出しごとに順番に使う
+# (モジュール共有の random 関数を毎回呼ばずに済む。全ツールが同じイベントループ上で動くためロックは不要)
+_DELAY_RING_SIZE = 4096  # 2 のべき乗
+_RNG = random.Random()
+_DELAY_RING = [_RNG.random() for _ in range(_DELAY_RING_SIZE)]
+_delay_counter = itertools.count()
+
+
+async def _simulate_delay(low: float, high: float) -> None:
+    """Sleep for a random delay between low and high seconds, or for MOCK_DELAY if it is set."""
+    if MOCK_DELAY is None:
+        await asyncio.sleep(low + (high - low) * _DELAY_RING[next(_delay_counter) & (_DELAY_RING_SIZE - 1)])
+    elif MOCK_DELAY > 0:
+        await asyncio.sleep(MOCK_DELAY)
+
+
 @mcp.tool()
 async def echo(message: str):
     """Echoes back the input message. Useful for testing."""
     # 簡単な遅延をシミュレート
-    await asyncio.sleep(0.5)
+    await _simulate_delay(0.5, 0.5)
     return message
 
 
 @mcp.tool()
 async def add(number1: int, number2: int) -> int:
     """Adds two numbers together."""
-    await asyncio.sleep(random.uniform(0.2, 1.0))  # ランダムな遅延
+    await _simulate_delay(0.2, 1.0)  # ランダムな遅延
     return number1 + number2
 
 
 @mcp.tool()
 async def web_search(query: str, num_results: int | None = None) -> list[dict[str, str]]:
     """Performs a mock web search and returns dummy results."""
-    await asyncio.sleep(random.uniform(1.0, 3.0))  # 検索は少し時間がかかる想定
-    # ダミーの検索結果を生成
-    mock_results = []
-    num = num_results or 5
-    for i in range(num):
-        mock_results.append(
-            {
-                "title": f"Mock Result {i + 1} for '{query}'",
-                "url": f"http://example.com/search?q={query}&page={i + 1}",
-                "snippet": f"This is a dummy snippet for result {i + 1} about {query}.",
-            }
-        )
-    return mock_results
-
-
-def create_starlette_app(mcp_server: Server, *, debug: bool = False) -> Starlette:
+    await _simulate_delay(1.0, 3.0)  # 検索は少し時間がかかる想定
+    # ダミーの検索結果をテンプレートから生成
+    return [
+        {
+            "title": title.format(query=query),
+            "url": url.format(query=query),
+            "snippet": snippet.format(query=query),
+        }
+        for title, url, snippet in _result_templates(num_results or 5)
+    ]
+
+
+class BoundedWriteStream:
+    """
+    Buffers messages for an SSE connection in a bounded queue and forwards them from a separate task.
+    When a slow client lets the queue fill up, the connection is cancelled instead of blocking the server.
+    """
+
+    def __init__(self, write_stream: MemoryObjectSendStream, max_size: int, cancel_scope: anyio.CancelScope):
+        self._write_stream = write_stream
+        self._send_queue, self._receive_queue = anyio.create_memory_object_stream(max_size)
+        self._cancel_scope = cancel_scope
+
+    async def send(self, item) -> None:
+        try:
+            self._send_queue.send_nowait(item)
+        except anyio.WouldBlock:
+            # 読み取りが追いつかないクライアントは切断する
+            self._cancel_scope.cancel()
+        # 送信側が続けて送っても転送タスクが動けるよう、ここで一度制御を譲る
+        await anyio.lowlevel.checkpoint()
+
+    async def drain(self) -> None:
+        """Forward queued messages to the underlying write stream until this stream is closed."""
+        async with self._receive_queue, self._write_stream:
+            async for item in self._receive_queue:
+                await self._write_stream.send(item)
+
+    async def aclose(self) -> None:
+        await self._send_queue.aclose()
+
+    async def __aenter__(self) -> "BoundedWriteStream":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+
+def create_starlette_app(mcp_server: "Server", *, debug: bool = False, sse_queue_size: int = 100) -> "Starlette":
     """Create a Starlette application that can server the provided mcp server with SSE."""
+    # ツール定義だけを使う場合に読み込まずに済むよう、ここでインポートする
+    from mcp.server.sse import SseServerTransport
+    from starlette.applications import Starlette
+    from starlette.routing import Mount, Route
+
     sse = SseServerTransport("/messages/")
 
-    async def handle_sse(request: Request) -> None:
+    async def handle_sse(request: "Request") -> None:
         async with sse.connect_sse(
             request.scope,
             request.receive,
             request._send,
         ) as (read_stream, write_stream):
-            await mcp_server.run(
-                read_stream,
-                write_stream,
-                mcp_server.create_initialization_options(),
-            )
+            async with anyio.create_task_group() as tg:
+                bounded_write_stream = BoundedWriteStream(write_stream, sse_queue_size, tg.cancel_scope)
+                tg.start_soon(bounded_write_stream.drain)
+                await mcp_server.run(
+                    read_stream,
+                    bounded_write_stream,  # type: ignore
+                    mcp_server.create_initialization_options(),
+                )
 
     return Starlette(
         debug=debug,
@@ -71,17 +176,68 @@ def create_starlette_app(mcp_server: Server, *, debug: bool = False) -> Starlett
     )
 
 
+def create_streamable_http_app(mcp_server: "Server", *, debug: bool = False) -> "Starlette":
+    """Create a Starlette application that serves the provided mcp server over Streamable HTTP at /mcp."""
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+
+    # POST で受けたリクエストへの応答は同じ HTTP 応答の SSE ストリームで返す (セッションは Mcp-Session-Id で管理)
+    session_manager = StreamableHTTPSessionManager(app=mcp_server)
+
+    async def handle_streamable_http(scope: "Scope", receive: "Receive", send: "Send") -> None:
+        await session_manager.handle_request(scope, receive, send)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: "Starlette") -> AsyncIterator[None]:
+        # セッションごとのタスクはアプリの起動から終了までの間だけ動かす
+        async with session_manager.run():
+            yield
+
+    return Starlette(
+        debug=debug,
+        routes=[Mount("/mcp", app=handle_streamable_http)],
+        lifespan=lifespan,
+    )
+
+
 if __name__ == "__main__":
     mcp_server = mcp._mcp_server
 
     import argparse
 
-    parser = argparse.ArgumentParser(description="Run MCP SSE-based server")
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run MCP SSE-based or Streamable HTTP server")
     parser.add_argument("--host", default="localhost", help="Host to bind to")
     parser.add_argument("--port", type=int, default=8002, help="Port to listen on")
+    parser.add_argument(
+        "--sse-queue-size", type=int, default=100, help="Max buffered messages per SSE client before disconnecting"
+    )
+    parser.add_argument(
+        "--transport",
+        choices=["sse", "streamable-http"],
+        default="sse",
+        help="Transport to serve: legacy SSE at /sse or Streamable HTTP at /mcp",
+    )
     args = parser.parse_args()
 
-    # Bind SSE request handling to MCP server
-    starlette_app = create_starlette_app(mcp_server, debug=True)
-
-    uvicorn.run(starlette_app, host=args.host, port=args.port)
+    if args.transport == "streamable-http":
+        starlette_app = create_streamable_http_app(mcp_server, debug=True)
+    else:
+        # Bind SSE request handling to MCP server
+        starlette_app = create_starlette_app(mcp_server, debug=True, sse_queue_size=args.sse_queue_size)
+
+    # uvloop / httptools があれば使う (uvicorn[standard] に含まれる。uvloop は Windows 非対応)
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    # リクエストごとのアクセスログは出さない (SSE のメッセージごとに出力されるため)
+    uvicorn.run(
+        starlette_app,
+        host=args.host,
+        port=args.port,
+        loop=loop,
+        http=http,
+        log_level="warning",
+        access_log=False,
+    )
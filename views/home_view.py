@@ -1,7 +1,15 @@
+import contextlib
+import logging
+import math
+import time
+
 import flet as ft
 from mcp import Tool
 
 from mcp_client import MCPClient
+from views.tool_view import register_tool_info
+
+log = logging.getLogger(__name__)
 
 
 class HomeView(ft.View):
@@ -9,6 +17,16 @@ class HomeView(ft.View):
 
     page: ft.Page
 
+    # ツール一覧は表示範囲の行だけ ListTile を作る (仮想化)。1行の高さと行間(px)
+    ROW_HEIGHT = 72
+    ROW_SPACING = 5
+    # 表示範囲の前後に余分に用意しておく行数
+    PREFETCH_ROWS = 5
+    # 実際の表示領域の高さが分かるまで使う仮の値(px)
+    DEFAULT_VIEWPORT_HEIGHT = 800
+    # ツールを受け取りながら表示するときに、画面を更新する最短の間隔(秒)
+    STREAM_UPDATE_INTERVAL = 0.1
+
     def __init__(self, page: ft.Page, mcp_client: MCPClient):
         super().__init__(
             route="/",
@@ -19,7 +37,23 @@ class HomeView(ft.View):
 
         self.loading_indicator = ft.ProgressRing(visible=False)
         self.status_text = ft.Text(visible=False)  # エラーや情報表示用
-        self.tool_list_view = ft.ListView(expand=True, spacing=5, padding=10)
+        # 表示中のツール一覧と、ListView に並べている先頭の行番号
+        self.tools: list[Tool] = []
+        # load_tools を呼ぶたびに増える番号 (古い読み込みが結果を書き込まないようにする)
+        self._load_generation = 0
+        self._first_index = 0
+        self._viewport_height: float = self.DEFAULT_VIEWPORT_HEIGHT
+        # 使い回す行 (Container に包んだ ListTile) と、表示範囲外の行の高さを確保するスペーサー
+        self._row_pool: list[ft.Container] = []
+        self._top_spacer = ft.Container(height=0)
+        self._bottom_spacer = ft.Container(height=0)
+        self.tool_list_view = ft.ListView(
+            expand=True,
+            spacing=self.ROW_SPACING,
+            padding=10,
+            on_scroll=self._on_scroll,
+            on_scroll_interval=50,
+        )
 
         self.appbar = ft.AppBar(
             title=ft.Text("利用可能なMCPツール"),
@@ -40,11 +74,18 @@ class HomeView(ft.View):
         await self.load_tools(None)  # 初回読み込み
 
     async def load_tools(self, e):
-        """MCPサーバーからツールリストを取得して表示する"""
+        """
+        MCPサーバーからツールリストを取得して表示する.
+        更新ボタンから呼ばれた場合 (e が None でない) はキャッシュを捨ててサーバーに問い合わせ直す.
+        """
+        if e is not None:
+            self.mcp_client.invalidate_tools()
+        # 読み込み中に更新ボタンが押された場合は、前の読み込みの結果を捨てて新しい読み込みだけを表示する
+        self._load_generation += 1
+        generation = self._load_generation
+        self.tools = []
+        self._first_index = 0
         self.tool_list_view.controls.clear()
-        self.status_text.visible = False
-        self.loading_indicator.visible = True
-        self.page.update()
 
         if not self.mcp_client.session:
             self.status_text.value = "MCPサーバーに接続されていません。\n設定画面でMCPサーバーを設定してください。"
@@ -53,61 +94,135 @@ class HomeView(ft.View):
             self.page.update()
             return
 
+        # 最初のツールが届くまではインジケーターを表示する (取得結果の反映は finally でまとめて行う)
+        self.status_text.visible = False
+        self.loading_indicator.visible = True
+        self._viewport_height = self.page.height or self.DEFAULT_VIEWPORT_HEIGHT
+        self.page.update()
+
         try:
-            tools = await self.mcp_client.get_tools()
-            if not tools:
+            # 受け取ったツールから順に表示する (画面の更新は一定間隔ごとにまとめる)
+            last_update = time.monotonic()
+            async with contextlib.aclosing(self.mcp_client.iter_tools()) as tools:
+                async for tool in tools:
+                    if generation != self._load_generation:
+                        return  # 新しい読み込みが始まったため中断する
+                    self._append_tool(tool)
+                    now = time.monotonic()
+                    if self.loading_indicator.visible or now - last_update >= self.STREAM_UPDATE_INTERVAL:
+                        self.loading_indicator.visible = False
+                        self.page.update()
+                        last_update = now
+            if generation != self._load_generation:
+                return
+            if not self.tools:
                 self.status_text.value = "利用可能なツールが見つかりませんでした。"
                 self.status_text.visible = True
-            else:
-                self.display_tools(tools)
 
         except (ValueError, ConnectionError, TimeoutError, RuntimeError) as ex:
+            if generation != self._load_generation:
+                return
             self.status_text.value = f"ツールリストの取得に失敗しました:\n{ex}"
             self.status_text.color = ft.Colors.ERROR
             self.status_text.visible = True
         except Exception as ex:
+            if generation != self._load_generation:
+                return
             self.status_text.value = f"予期しないエラーが発生しました:\n{ex}"
             self.status_text.color = ft.Colors.ERROR
             self.status_text.visible = True
         finally:
-            self.loading_indicator.visible = False
-            self.page.update()
-
-    def display_tools(self, tools: list[Tool]):
-        """取得したツールリストをListViewに表示する"""
-        self.tool_list_view.controls.clear()
-        for tool in tools:
-            tool_name = tool.name
-            tool_desc = tool.description or "説明がありません。"
-            # input_schema を ToolView に渡すために保持
-            # (toolオブジェクト全体を渡しても良いが、必要な情報だけにする方がメモリ効率が良い場合も)
-            tool_info = tool  # toolオブジェクト全体を渡すことにする
-
-            list_tile = ft.ListTile(
-                title=ft.Text(tool_name),
-                subtitle=ft.Text(tool_desc, max_lines=2, overflow=ft.TextOverflow.ELLIPSIS),
-                trailing=ft.Icon(ft.icons.CHEVRON_RIGHT),
-                data=tool_info,  # Fletコントロールにデータを付与できる
-                on_click=self.go_to_tool_view,
-                tooltip=f"{tool_name}: {tool_desc}",  # ホバーで詳細表示
-            )
-            self.tool_list_view.controls.append(list_tile)
+            if generation == self._load_generation:
+                self.loading_indicator.visible = False
+                self.page.update()
+
+    def _append_tool(self, tool: Tool):
+        """ツールを1つ一覧の末尾に追加する. 表示範囲に入る場合だけ行を並べ直し、それ以外はスペーサーを伸ばす"""
+        self.tools.append(tool)
+        row_pitch = self.ROW_HEIGHT + self.ROW_SPACING
+        num_rows = math.ceil(self._viewport_height / row_pitch) + 2 * self.PREFETCH_ROWS
+        if len(self.tools) <= self._first_index + num_rows:
+            self._render_rows(self._first_index)
+        else:
+            self._bottom_spacer.height = (self._bottom_spacer.height or 0) + row_pitch
+
+    def _create_row(self) -> ft.Container:
+        """使い回し用の行を作る. 内容は _bind_row で設定する"""
+        list_tile = ft.ListTile(
+            title=ft.Text(),
+            subtitle=ft.Text(max_lines=2, overflow=ft.TextOverflow.ELLIPSIS),
+            trailing=ft.Icon(ft.icons.CHEVRON_RIGHT),
+            on_click=self.go_to_tool_view,
+        )
+        # ツールチップはマウスが乗った行だけ _on_row_hover で設定する
+        return ft.Container(content=list_tile, height=self.ROW_HEIGHT, on_hover=self._on_row_hover)
+
+    def _bind_row(self, row: ft.Container, index: int):
+        """行の ListTile の表示内容を index 番目のツールに合わせて書き換える"""
+        list_tile = row.content
+        assert isinstance(list_tile, ft.ListTile)
+        tool = self.tools[index]
+        tool_desc = tool.description or "説明がありません。"
+        list_tile.title.value = tool.name  # type: ignore
+        list_tile.subtitle.value = tool_desc  # type: ignore
+        list_tile.tooltip = None  # 前に表示していたツールのツールチップを消す
+        # ツールは self.tools に一元管理し、行にはその番号だけを持たせる
+        list_tile.data = index  # Fletコントロールにデータを付与できる
+
+    def _on_row_hover(self, e: ft.ControlEvent):
+        """行に初めてマウスが乗ったときに、ツールの詳細をツールチップに設定する"""
+        list_tile = e.control.content
+        index = list_tile.data
+        if e.data != "true" or list_tile.tooltip is not None or not isinstance(index, int) or index >= len(self.tools):
+            return
+        tool = self.tools[index]
+        list_tile.tooltip = f"{tool.name}: {tool.description or '説明がありません。'}"  # ホバーで詳細表示
+        list_tile.update()
+
+    def _render_rows(self, first_index: int):
+        """first_index 行目から表示範囲 (+前後の余裕) の分だけ行を並べ、残りはスペーサーで高さを確保する"""
+        row_pitch = self.ROW_HEIGHT + self.ROW_SPACING
+        num_rows = math.ceil(self._viewport_height / row_pitch) + 2 * self.PREFETCH_ROWS
+        first_index = max(0, min(first_index, len(self.tools) - 1))
+        last_index = min(len(self.tools), first_index + num_rows)
+
+        while len(self._row_pool) < last_index - first_index:
+            self._row_pool.append(self._create_row())
+        rows = self._row_pool[: last_index - first_index]
+        for row, index in zip(rows, range(first_index, last_index), strict=True):
+            self._bind_row(row, index)
+
+        self._first_index = first_index
+        self._top_spacer.height = first_index * row_pitch
+        self._bottom_spacer.height = (len(self.tools) - last_index) * row_pitch
+        self.tool_list_view.controls = [self._top_spacer, *rows, self._bottom_spacer]
+
+    def _on_scroll(self, e: ft.OnScrollEvent):
+        """スクロール位置から表示範囲を求め、範囲が変わったときだけ行を付け替える"""
+        if not self.tools:
+            return
+        row_pitch = self.ROW_HEIGHT + self.ROW_SPACING
+        first_index = max(0, int(e.pixels // row_pitch) - self.PREFETCH_ROWS)
+        if first_index == self._first_index and e.viewport_dimension == self._viewport_height:
+            return
+        self._viewport_height = e.viewport_dimension
+        self._render_rows(first_index)
+        self.tool_list_view.update()
 
     async def go_to_tool_view(self, e: ft.ControlEvent):
         """ListTileがクリックされたときにツール実行画面に遷移する"""
-        selected_tool_info = e.control.data  # ListTileに付与したデータを取得
-        assert isinstance(selected_tool_info, Tool), "選択されたツール情報が不正です。"
+        index = e.control.data  # ListTileに付与したツールの番号を取得
+        assert isinstance(index, int), "選択されたツール情報が不正です。"
+        assert 0 <= index < len(self.tools), "選択されたツール情報が不正です。"
+        selected_tool_info = self.tools[index]
         tool_name = selected_tool_info.name
         if tool_name:
-            # --- page オブジェクトに一時属性として格納 ---
+            # ツール実行画面が名前で参照できるよう登録しておく
+            register_tool_info(selected_tool_info)
             try:
-                # page オブジェクトにカスタム属性を追加して情報を保持
-                self.page.selected_tool_info_temp = selected_tool_info  # type: ignore
-                print(f"ツール情報 ({tool_name}) を page オブジェクトの一時属性に格納しました。")
-
                 # 画面遷移
                 self.page.go(f"/tool/{tool_name}")
-            except Exception as ex:
-                print(f"ページ属性の設定または画面遷移中にエラー: {ex}")
+            except Exception:
+                log.exception("画面遷移中にエラー")
         else:
-            print("エラー：クリックされたツールに名前がありません。")
+            log.error("クリックされたツールに名前がありません。")
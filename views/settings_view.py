@@ -1,25 +1,61 @@
 import asyncio
+import logging
 
 # ServerManager の型ヒント用にインポート（循環参照に注意）
 # from __main__ import ServerManager # これは避けるべき
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, ClassVar, Dict, List, Optional, Tuple
 
 import flet as ft
 
+from async_loop_thread import AsyncLoopThread
 from config_manager import ConfigManager
-from mcp_client import MCPClient
+from mcp_client import ConnectionProbe, MCPClient
 
 if TYPE_CHECKING:
     from main import ServerManager  # 実行時ではなく型チェック時にのみインポート
 
+log = logging.getLogger(__name__)
+
+
+# サーバーの状態表示 {(内蔵モックか, 実行中か): (アイコン, 色, 状態の説明)}
+_STATUS_STYLES = {
+    (True, True): (ft.icons.CIRCLE, ft.Colors.GREEN_ACCENT_700, "実行中"),
+    (True, False): (ft.icons.ERROR_OUTLINE, ft.Colors.RED_ACCENT_700, "停止中"),
+    (False, True): (ft.icons.CIRCLE, ft.Colors.YELLOW_ACCENT_700, "認識中"),
+    (False, False): (ft.icons.ERROR_OUTLINE, ft.Colors.RED_ACCENT_700, "不具合あり"),
+}
+
+
+def _status_label(is_running: bool, is_internal: bool) -> str:
+    """サーバーの状態の説明 ("実行中" など) を返す"""
+    return _STATUS_STYLES[(is_internal, is_running)][2]
+
+
+def _status_icon(is_running: bool, is_internal: bool) -> ft.Icon:
+    """サーバーの状態を表すアイコンを作る"""
+    name, color, label = _STATUS_STYLES[(is_internal, is_running)]
+    return ft.Icon(name=name, color=color, tooltip=label, size=16)
+
 
 class SettingsView(ft.View):
     """MCPサーバー設定画面"""
 
     page: ft.Page
 
+    # 有効/無効スイッチの連続操作をまとめて1回の保存にするための待ち時間 (秒)
+    SAVE_DEBOUNCE_SECONDS = 0.2
+
+    # アクティブサーバー選択の (キー, 表示名) の一覧 (設定, 版数, 一覧)。画面を開き直しても設定が同じ間は使い回す
+    # Fletのコントロールは複数の画面で共有できないため、Option 自体は毎回作る
+    _option_items_cache: ClassVar[Optional[Tuple[ConfigManager, int, List[Tuple[str, str]]]]] = None
+
     def __init__(
-        self, page: ft.Page, config_manager: ConfigManager, mcp_client: MCPClient, server_manager: "ServerManager"
+        self,
+        page: ft.Page,
+        config_manager: ConfigManager,
+        mcp_client: MCPClient,
+        server_manager: "ServerManager",
+        loop_thread: Optional[AsyncLoopThread] = None,
     ):
         super().__init__(
             route="/settings",
@@ -30,12 +66,28 @@ class SettingsView(ft.View):
         self.config_manager = config_manager
         self.mcp_client = mcp_client
         self.server_manager = server_manager  # ServerManagerインスタンスを受け取る
+        self.loop_thread = loop_thread  # 接続テストをUIとは別のループで行うためのスレッド (無ければUIのループで行う)
+        # 接続テストの接続は同じURLの間は使い回し、画面を離れるときに close_probe() で閉じる
+        self._probe = ConnectionProbe()
 
         # --- 現在の設定読み込み ---
         current_config = self.config_manager.get_config()
         self.active_server_key = current_config.get("active_server_key", "internal_mock")
         self.external_url = current_config.get("external_mcp_url", "")
 
+        # 管理対象サーバーの行ごとの部品 {server_key: {"row": 行, "status_icon": 状態アイコン, "switch": スイッチ}}
+        # スイッチ操作時に、リスト全体を作り直さずに該当行だけ書き換えるために使う
+        self._row_by_key: Dict[str, Dict[str, ft.Control]] = {}
+        # サーバー情報エリアのコントロールのキャッシュ {(server_key, 設定の版数, 実行中か): コントロール}
+        # Dropdown で選択を切り替えるたびに同じコントロールを作り直さないようにする
+        self._info_cache: Dict[Tuple[str, int, bool], List[ft.Control]] = {}
+        # 保存待ちの有効/無効の変更 {server_key: 有効か} と、それを保存するタスク・保存を始める時刻
+        self._pending_enabled: Dict[str, bool] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_deadline = 0.0
+        # 設定ファイルへの書き込みはワーカースレッドで行うため、同時に1つだけになるようにする
+        self._save_lock = asyncio.Lock()
+
         # --- UI コントロール ---
         # アクティブサーバー選択ドロップダウン
         self.server_selection_dd = ft.Dropdown(
@@ -72,7 +124,7 @@ class SettingsView(ft.View):
         self.save_button = ft.ElevatedButton("保存して戻る", on_click=self.save_settings)
 
         # URLフィールド変更時にテストボタンの状態更新
-        self.mcp_url_field.on_change = lambda e: self.update_test_button_state()
+        self.mcp_url_field.on_change = self.on_url_change
 
         # --- レイアウト ---
         self.appbar = ft.AppBar(title=ft.Text("MCP設定"), bgcolor=ft.Colors.SURFACE)
@@ -94,17 +146,31 @@ class SettingsView(ft.View):
 
     def _build_server_options(self) -> list:
         """アクティブサーバー選択Dropdownの選択肢を生成"""
-        options = [
-            ft.dropdown.Option(key="internal_mock", text="内蔵モックサーバー"),
-            ft.dropdown.Option(key="external", text="外部URLを指定"),
-        ]
+        return [ft.dropdown.Option(key=key, text=text) for key, text in self._server_option_items()]
+
+    def _server_option_items(self) -> List[Tuple[str, str]]:
+        """選択肢の (キー, 表示名) の一覧を返す (設定の版数が変わるまではキャッシュを使う)"""
+        version = self.config_manager.get_version()
+        cache = SettingsView._option_items_cache
+        if cache is not None and cache[0] is self.config_manager and cache[1] == version:
+            return cache[2]
+        items = [("internal_mock", "内蔵モックサーバー"), ("external", "外部URLを指定")]
         user_servers = self.config_manager.get_mcp_servers_config()
         for key in user_servers.keys():
             # キー名をそのまま表示（必要なら設定ファイルに表示名を追加しても良い）
-            options.append(ft.dropdown.Option(key=key, text=f"管理サーバー: {key}"))
-        return options
+            items.append((key, f"管理サーバー: {key}"))
+        SettingsView._option_items_cache = (self.config_manager, version, items)
+        return items
 
     def _build_server_info_controls(self, server_key: str) -> list:
+        """選択されたサーバーに応じた情報コントロールを返す (設定と実行状態が同じ間はキャッシュを使う)"""
+        cache_key = (server_key, self.config_manager.get_version(), self.server_manager.is_running(server_key))
+        controls = self._info_cache.get(cache_key)
+        if controls is None:
+            controls = self._info_cache[cache_key] = self._create_server_info_controls(server_key)
+        return controls
+
+    def _create_server_info_controls(self, server_key: str) -> list:
         """選択されたサーバーに応じた情報コントロールを生成"""
         controls = []
         url = ""
@@ -136,23 +202,9 @@ class SettingsView(ft.View):
         # サーバーの実行状態を表示 (ServerManagerから取得)
         if config and server_key != "external":
             is_running = self.server_manager.is_running(server_key)
-            if server_key == "internal_mock":
-                status_text_str = "実行中" if is_running else "停止中"
-                status_icon = ft.Icon(
-                    name=ft.icons.CIRCLE if is_running else ft.icons.ERROR_OUTLINE,
-                    color=ft.Colors.GREEN_ACCENT_700 if is_running else ft.Colors.RED_ACCENT_700,
-                    tooltip=status_text_str,
-                    size=16,
-                )
-            else:
-                status_text_str = "認識中" if is_running else "不具合あり"
-                status_icon = ft.Icon(
-                    name=ft.icons.CIRCLE if is_running else ft.icons.ERROR_OUTLINE,
-                    color=ft.Colors.YELLOW_ACCENT_700 if is_running else ft.Colors.RED_ACCENT_700,
-                    tooltip=status_text_str,
-                    size=16,
-                )
-            status_text = ft.Text(status_text_str, size=12)
+            is_internal = server_key == "internal_mock"
+            status_icon = _status_icon(is_running, is_internal)
+            status_text = ft.Text(_status_label(is_running, is_internal), size=12)
             controls.append(ft.Row([status_icon, status_text], spacing=5))
 
         return controls
@@ -160,28 +212,12 @@ class SettingsView(ft.View):
     def _build_managed_server_list(self) -> list:
         """管理対象サーバーの一覧と有効/無効スイッチを表示"""
         controls = []
-        all_servers = self.config_manager.get_all_managed_servers()
+        self._row_by_key.clear()
+        entries = self.config_manager.get_entries()
 
-        for key, config in all_servers:
-            is_enabled = config.get("enabled", False) if isinstance(config, dict) else False
+        for key, server_entry in entries.items():
             is_running = self.server_manager.is_running(key)
-
-            if key == "internal_mock":
-                status_text_str = "実行中" if is_running else "停止中"
-                status_icon = ft.Icon(
-                    name=ft.icons.CIRCLE if is_running else ft.icons.ERROR_OUTLINE,
-                    color=ft.Colors.GREEN_ACCENT_700 if is_running else ft.Colors.RED_ACCENT_700,
-                    tooltip=status_text_str,
-                    size=16,
-                )
-            else:
-                status_text_str = "認識中" if is_running else "不具合あり"
-                status_icon = ft.Icon(
-                    name=ft.icons.CIRCLE if is_running else ft.icons.ERROR_OUTLINE,
-                    color=ft.Colors.YELLOW_ACCENT_700 if is_running else ft.Colors.RED_ACCENT_700,
-                    tooltip=status_text_str,
-                    size=16,
-                )
+            status_icon = _status_icon(is_running, key == "internal_mock")
 
             # サーバー名と状態アイコン
             server_label = ft.Row(
@@ -194,7 +230,7 @@ class SettingsView(ft.View):
 
             # 有効/無効スイッチ
             enable_switch = ft.Switch(
-                value=is_enabled,
+                value=server_entry.enabled,
                 data=key,  # スイッチにサーバーキーを紐付ける
                 on_change=self.toggle_server_enabled,
                 tooltip="アプリ起動時にこのサーバーを自動起動する",
@@ -203,34 +239,32 @@ class SettingsView(ft.View):
             # 説明 (コマンドなど)
             description = ""
             if key == "internal_mock":
-                description = f"内蔵Pythonモック (ポート: {config.get('port', 8001)})"
-            elif "command" in config:
-                description = f"Cmd: {config['command']} {config.get('args', [])[:2]}..."  # 引数を少し表示
-                if "port" in config:
-                    description += f" (ポート: {config['port']})"
+                description = f"内蔵Pythonモック (ポート: {server_entry.port or 8001})"
+            elif server_entry.command is not None:
+                description = f"Cmd: {server_entry.command} {list(server_entry.args[:2])}..."  # 引数を少し表示
+                if server_entry.port is not None:
+                    description += f" (ポート: {server_entry.port})"
 
             if key == "internal_mock":
-                controls.append(
-                    ft.Row(
-                        [
-                            ft.Column([server_label, ft.Text(description, size=11, italic=True)], expand=True),
-                            ft.Row([ft.Text("自動起動:", size=12), enable_switch], alignment=ft.MainAxisAlignment.END),
-                        ],
-                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
-                        vertical_alignment=ft.CrossAxisAlignment.CENTER,
-                    )
+                row = ft.Row(
+                    [
+                        ft.Column([server_label, ft.Text(description, size=11, italic=True)], expand=True),
+                        ft.Row([ft.Text("自動起動:", size=12), enable_switch], alignment=ft.MainAxisAlignment.END),
+                    ],
+                    alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                    vertical_alignment=ft.CrossAxisAlignment.CENTER,
                 )
             else:
-                controls.append(
-                    ft.Row(
-                        [
-                            ft.Column([server_label, ft.Text(description, size=11, italic=True)], expand=True),
-                        ],
-                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
-                        vertical_alignment=ft.CrossAxisAlignment.CENTER,
-                    )
+                row = ft.Row(
+                    [
+                        ft.Column([server_label, ft.Text(description, size=11, italic=True)], expand=True),
+                    ],
+                    alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                    vertical_alignment=ft.CrossAxisAlignment.CENTER,
                 )
+            controls.append(row)
             controls.append(ft.Divider(height=5))
+            self._row_by_key[key] = {"row": row, "status_icon": status_icon, "switch": enable_switch}
 
         return controls
 
@@ -258,44 +292,99 @@ class SettingsView(ft.View):
         """管理対象サーバーの有効/無効スイッチが変更されたときの処理"""
         server_key = e.control.data
         new_enabled_state = e.control.value
-        print(f"サーバー '{server_key}' の有効状態を {new_enabled_state} に変更します。")
-
-        # 設定ファイルに保存
-        config = self.config_manager.get_config()
-        save_needed = False
-        if server_key == "internal_mock":
-            if config["internal_mock_config"]["enabled"] != new_enabled_state:
-                config["internal_mock_config"]["enabled"] = new_enabled_state
-                save_needed = True
-        elif server_key in config["mcpServers"]:
-            if config["mcpServers"][server_key]["enabled"] != new_enabled_state:
-                config["mcpServers"][server_key]["enabled"] = new_enabled_state
-                save_needed = True
-
-        if save_needed:
-            if self.config_manager.save_config(config, merge_with_current=False):
-                self.status_text.value = f"サーバー '{server_key}' の自動起動設定を更新しました。"
-                self.status_text.color = ft.Colors.GREEN
-                # ServerManagerに状態同期を促す (ここでは保存のみ、同期はメインループが行う)
-                # await self.server_manager.sync_server_states() # ここで同期すると時間がかかるかも
-            else:
-                self.status_text.value = f"サーバー '{server_key}' の設定保存に失敗しました。"
-                self.status_text.color = ft.Colors.ERROR
-                # スイッチの状態を元に戻す？
-                e.control.value = not new_enabled_state
+        log.debug("サーバー '%s' の有効状態を %s に変更します。", server_key, new_enabled_state)
+
+        # 保存は少し待ってからまとめて行う (待っている間の操作は保存待ちの変更を書き換えるだけ)
+        self._pending_enabled[server_key] = new_enabled_state
+        self._flush_deadline = asyncio.get_running_loop().time() + self.SAVE_DEBOUNCE_SECONDS
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_config_soon())
+
+        # 管理対象サーバーリストの該当行だけ、スイッチと状態アイコンを更新する
+        entry = self._row_by_key.get(server_key)
+        if entry is not None:
+            switch = entry["switch"]
+            assert isinstance(switch, ft.Switch)
+            switch.value = e.control.value
+            status_icon = entry["status_icon"]
+            assert isinstance(status_icon, ft.Icon)
+            self._update_status_icon(status_icon, server_key, self.server_manager.is_running(server_key))
         else:
+            # 行が見つからない (サーバーが追加・削除された) 場合はリスト部分を再構築して差し替え
+            self.controls[-1] = ft.Column(self._build_managed_server_list())
+
+        self.page.update()
+
+    async def _flush_config_soon(self):
+        """最後のスイッチ操作から SAVE_DEBOUNCE_SECONDS 経ったら、保存待ちの変更を設定ファイルに保存する"""
+        loop = asyncio.get_running_loop()
+        # 保存中に操作された分は、次の待ち時間の後で保存する
+        while self._pending_enabled:
+            while (delay := self._flush_deadline - loop.time()) > 0:
+                await asyncio.sleep(delay)
+            await self._save_pending_enabled()
+
+    async def _save_pending_enabled(self):
+        """保存待ちの有効/無効の変更を、ワーカースレッドで設定ファイルに書き込む"""
+        pending, self._pending_enabled = self._pending_enabled, {}
+        # 設定が変わらない操作 (オン→オフ→オンなど) は書き込まずに済ませる
+        changes = {
+            server_key: enabled
+            for server_key, enabled in pending.items()
+            if (entry := self.config_manager.get_entry(server_key)) is not None and entry.enabled != enabled
+        }
+        if not changes:
             self.status_text.value = ""  # 変更なし
+            self.page.update()
+            return
 
-        # UIの管理対象サーバーリストを再描画して状態アイコンを更新 (少し遅延があるかも)
-        # TODO: リスト全体を再描画するのではなく、該当行だけ更新したい
-        self.controls[-1] = ft.Column(self._build_managed_server_list())  # リスト部分を再構築して差し替え
+        # ディスクへの書き込みでUIのイベントループを止めないよう、ワーカースレッドで保存する
+        async with self._save_lock:
+            saved_keys = await asyncio.to_thread(self.config_manager.set_enabled, changes)
 
+        if saved_keys is None:
+            names = ", ".join(f"'{server_key}'" for server_key in changes)
+            self.status_text.value = f"サーバー {names} の設定保存に失敗しました。"
+            self.status_text.color = ft.Colors.ERROR
+            # スイッチの状態を元に戻す
+            for server_key, enabled in changes.items():
+                row = self._row_by_key.get(server_key)
+                if row is not None:
+                    switch = row["switch"]
+                    assert isinstance(switch, ft.Switch)
+                    switch.value = not enabled
+        elif saved_keys:
+            self._info_cache.clear()  # 保存した設定で作り直させる
+            names = ", ".join(f"'{server_key}'" for server_key in saved_keys)
+            self.status_text.value = f"サーバー {names} の自動起動設定を更新しました。"
+            self.status_text.color = ft.Colors.GREEN
+            # ServerManagerに状態同期を促す (ここでは要求のみ、同期はメインループが行う)
+            self.server_manager.request_sync()
+        else:
+            self.status_text.value = ""  # 変更なし (保存までの間に設定ファイルが変更された場合)
         self.page.update()
 
+    async def _wait_pending_saves(self):
+        """保存待ちのスイッチ操作があれば、待ち時間を打ち切って保存が終わるまで待つ"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_deadline = 0.0
+            await self._flush_task
+
+    @staticmethod
+    def _update_status_icon(status_icon: ft.Icon, server_key: str, is_running: bool):
+        """状態アイコンの表示をサーバーの実行状態に合わせて書き換える"""
+        status_icon.name, status_icon.color, status_icon.tooltip = _STATUS_STYLES[
+            (server_key == "internal_mock", is_running)
+        ]
+
     def update_test_button_state(self):
-        """外部URL入力時にテストボタンの有効/無効を更新"""
+        """外部URL入力時にテストボタンの有効/無効を更新 (画面への反映は呼び出し側の page.update() で行う)"""
         self.test_button.disabled = not str(self.mcp_url_field.value).strip()
-        self.page.update()  # 同期的に更新
+
+    def on_url_change(self, e):
+        """外部URLフィールドが変更されたときの処理"""
+        self.update_test_button_state()
+        self.page.update()
 
     async def test_external_connection(self, e):
         """外部URLで接続テストを行う"""
@@ -318,15 +407,13 @@ class SettingsView(ft.View):
         self.save_button.disabled = True
         self.page.update()
 
-        temp_client = MCPClient()
         try:
-            try:
-                await temp_client.connect_to_server(server_type="sse", server_command_or_server_url=url)
-                tools = await temp_client.get_tools()
-                self.status_text.value = f"接続成功！ {len(tools)}個のツールが見つかりました。"
-                self.status_text.color = ft.Colors.GREEN
-            finally:
-                await temp_client.aclose()
+            if self.loop_thread is not None:
+                num_tools = await self.loop_thread.run_coroutine(self._probe.count_tools(url))
+            else:
+                num_tools = await self._probe.count_tools(url)
+            self.status_text.value = f"接続成功！ {num_tools}個のツールが見つかりました。"
+            self.status_text.color = ft.Colors.GREEN
         except (ValueError, ConnectionError, TimeoutError, RuntimeError) as ex:
             self.status_text.value = f"接続失敗: {ex}"
             self.status_text.color = ft.Colors.ERROR
@@ -338,6 +425,13 @@ class SettingsView(ft.View):
             self.save_button.disabled = False
             self.page.update()
 
+    async def close_probe(self):
+        """接続テストで保持している接続を閉じる (接続したのと同じループで閉じる)"""
+        if self.loop_thread is not None:
+            await self.loop_thread.run_coroutine(self._probe.aclose())
+        else:
+            await self._probe.aclose()
+
     async def save_settings(self, e):
         """設定を保存し、前の画面（ホーム）に戻る"""
         new_active_key = self.server_selection_dd.value
@@ -360,16 +454,21 @@ class SettingsView(ft.View):
             return
 
         # --- 設定を保存 ---
+        # スイッチ操作の保存が残っていれば先に済ませる
+        await self._wait_pending_saves()
+        # ディスクへの書き込みはワーカースレッドで行い、UIのイベントループを止めない
         config_changed = False
-        if new_active_key and (self.config_manager.get_active_server_key() != new_active_key):
-            self.config_manager.set_active_server_key(new_active_key)
-            config_changed = True
+        async with self._save_lock:
+            if new_active_key and (self.config_manager.get_active_server_key() != new_active_key):
+                await asyncio.to_thread(self.config_manager.set_active_server_key, new_active_key)
+                config_changed = True
 
-        if new_active_key == "external" and self.config_manager.get_external_mcp_url() != new_external_url:
-            self.config_manager.set_external_mcp_url(new_external_url)
-            config_changed = True
+            if new_active_key == "external" and self.config_manager.get_external_mcp_url() != new_external_url:
+                await asyncio.to_thread(self.config_manager.set_external_mcp_url, new_external_url)
+                config_changed = True
 
         if config_changed:
+            self._info_cache.clear()  # 保存した設定で作り直させる
             self.status_text.value = "設定を保存しました。"
             self.status_text.color = ft.Colors.GREEN
 
@@ -1,11 +1,264 @@
-from typing import TYPE_CHECKING, Any, Dict, Optional
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 import flet as ft
 
 from mcp_client import MCPClient
 
+try:
+    import fastjsonschema
+except ImportError:  # fastjsonschema が無い環境では入力欄ごとの簡易チェックだけを行う
+    fastjsonschema = None
+
 if TYPE_CHECKING:
     from mcp import Tool
+    from mcp.types import CallToolResult
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class FieldSpec:
+    """入力欄1つ分の、スキーマから取り出しておく情報 (create_input_form で作り、_validate_inputs で使う)"""
+
+    field_type: str
+    required: bool
+    title: str
+    # テキスト入力の文字列を送信する値に変換する関数 (int, float, str)
+    coerce: Callable[[str], Any]
+    # このプロパティ自体のスキーマ (入力欄からフォーカスが外れたときの検証に使う)
+    schema: Dict[str, Any]
+    # 入力欄の値をスキーマで検証できるか (型を決められない anyOf などは、送る値の型が合わないため検証しない)
+    checkable: bool
+    # 入力欄に error_text があるか (Checkbox には無い)
+    supports_error_text: bool
+    # 入力欄の種類に合わせた値の読み取り関数 (入力欄を作るときに選んでおき、検証のたびに種類で分岐しない)
+    read: Callable[[Any, "FieldSpec"], Tuple[Any, Optional[str]]]
+    # エラー表示の文字列 (検証のたびに組み立てないよう、入力欄を作るときに用意しておく)
+    # ステータス欄のエラー行の先頭 ("'タイトル': ")、型変換できない場合の入力欄とステータス欄の表示
+    error_prefix: str
+    invalid_error_text: str
+    invalid_error_line: str
+
+
+# 入力欄の型ごとの変換関数
+_COERCERS: Dict[str, Callable[[str], Any]] = {"integer": int, "number": float}
+
+# 数値の入力欄で使う入力フィルター (コントロールではないため、全ての入力欄で共有できる)
+_INT_FILTER = ft.InputFilter(r"[0-9\-]")  # 整数のみ許可 (マイナスも)
+_NUM_FILTER = ft.InputFilter(r"[0-9\.\-]")  # 小数点とマイナスを許可 (より厳密な正規表現も可能)
+
+# 入力スキーマをコンパイルしたバリデーターのキャッシュ {(ツール名, スキーマのハッシュ): バリデーター}
+# コンパイルできないスキーマは None を入れておき、何度もコンパイルを試みないようにする
+_VALIDATOR_CACHE: Dict[Tuple[str, int], Optional[Callable[[Any], Any]]] = {}
+
+# 作成済みの入力フォームのキャッシュ {ツール名: (スキーマのハッシュ, フォームの行, 入力欄, 入力欄ごとのスキーマ情報)}
+# 同じツールを開き直したときはコントロールを作り直さずに使い回す (前回の入力内容も残る)。スキーマが変わったら作り直す
+# Fletのコントロールは別のセッションの画面には置けないため、キャッシュはセッション (page.session) ごとに持つ
+_FormCache = Dict[str, Tuple[int, List[ft.Control], Dict[str, ft.Control], Dict[str, "FieldSpec"]]]
+_FORM_CACHE_SESSION_KEY = "tool_view.form_cache"
+
+# ツール一覧で選ばれたツールの情報 {ツール名: ツール情報} (register_tool_info で登録し、ToolView で参照する)
+_TOOL_INFO_CACHE: Dict[str, "Tool"] = {}
+
+
+def register_tool_info(tool: "Tool"):
+    """ツール実行画面で使うツール情報を登録する (同じ名前のツールは新しい情報で置き換える)"""
+    _TOOL_INFO_CACHE[tool.name] = tool
+
+
+def _form_cache(page: ft.Page) -> _FormCache:
+    """page のセッション用の入力フォームのキャッシュを返す (無ければ作る)"""
+    cache = page.session.get(_FORM_CACHE_SESSION_KEY)
+    if cache is None:
+        cache = {}
+        page.session.set(_FORM_CACHE_SESSION_KEY, cache)
+    return cache
+
+
+def _schema_hash(schema: Dict[str, Any]) -> int:
+    """スキーマの内容から求めたハッシュ値を返す (キーの順序によらない)"""
+    return hash(json.dumps(schema, sort_keys=True, default=str))
+
+
+def _get_validator(tool_name: str, schema: Dict[str, Any]) -> Optional[Callable[[Any], Any]]:
+    """ツールの入力スキーマのバリデーターを返す (fastjsonschema が無いかコンパイルできない場合は None)"""
+    if fastjsonschema is None or not schema:
+        return None
+    key = (tool_name, _schema_hash(schema))
+    if key not in _VALIDATOR_CACHE:
+        try:
+            # 検証したデータに default を書き込まないようにする (空の任意項目は送らないため)
+            _VALIDATOR_CACHE[key] = fastjsonschema.compile(schema, use_default=False)
+        except fastjsonschema.JsonSchemaDefinitionException as ex:
+            log.warning("ツール '%s' の入力スキーマをコンパイルできませんでした: %s", tool_name, ex)
+            _VALIDATOR_CACHE[key] = None
+    return _VALIDATOR_CACHE[key]
+
+
+def _resolve_type_schema(prop_schema: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    入力欄を作るときに使う、型 (type) の分かるプロパティのスキーマを返す.
+    Optional[int] などの anyOf / oneOf は null 以外の候補が1つなら、その候補にタイトルなどを重ねたものを返す.
+    候補が複数あって型を決められない場合は None を返す.
+    """
+    variants = prop_schema.get("anyOf") or prop_schema.get("oneOf")
+    if "type" in prop_schema or not variants:
+        return prop_schema
+    non_null = [variant for variant in variants if variant.get("type") != "null"]
+    if len(non_null) != 1 or "type" not in non_null[0]:
+        return None
+    return {**non_null[0], **{key: value for key, value in prop_schema.items() if key not in ("anyOf", "oneOf")}}
+
+
+def _validation_schema(input_schema: Dict[str, Any], field_specs: Dict[str, "FieldSpec"]) -> Dict[str, Any]:
+    """入力スキーマのうち、入力欄の値を検証できないプロパティの条件を外したものを返す (必須の条件は残す)"""
+    unchecked = [name for name, spec in field_specs.items() if not spec.checkable]
+    if not unchecked:
+        return input_schema
+    properties = dict(input_schema.get("properties", {}))
+    for name in unchecked:
+        properties[name] = {}
+    return {**input_schema, "properties": properties}
+
+
+def _set_error_text(
+    spec: FieldSpec, control: ft.Control, error_text: Optional[str], changed: Optional[List[ft.Control]]
+):
+    """入力欄のエラー表示を設定する. 表示が変わった場合は changed に追加する"""
+    if not spec.supports_error_text or control.error_text == error_text:  # type: ignore
+        return
+    control.error_text = error_text  # type: ignore
+    if changed is not None:
+        changed.append(control)
+
+
+def _format_result(result: "CallToolResult") -> str:
+    """ツールの実行結果を表示用の文字列にする (複数のコンテンツは改行でつなげる。テキスト以外は文字列にする)"""
+    parts = []
+    for content in result.content:
+        text = getattr(content, "text", None)
+        parts.append(text if isinstance(text, str) else str(content))
+    return "\n".join(parts)
+
+
+# --- 入力値の読み取り (値, エラー) を返す. 型変換できない場合は ValueError ---
+
+
+def _read_text(control: ft.TextField, spec: FieldSpec) -> Tuple[Any, Optional[str]]:
+    raw_value = control.value.strip() if control.value else ""
+    if raw_value:  # 値がある場合のみ型変換
+        return spec.coerce(raw_value), None
+    if spec.required:
+        return None, "必須項目です。"
+    if spec.schema.get("type") == "string" and control.value is not None:
+        return "", None  # 空文字を許容する場合
+    # 文字列型と明示されていない空の任意項目 (数値や anyOf など) は送らない
+    # (None は引数から除かれる。"" を送るとスキーマの型チェックで弾かれる)
+    return None, None
+
+
+def _read_checkbox(control: ft.Checkbox, spec: FieldSpec) -> Tuple[Any, Optional[str]]:
+    return control.value, None  # bool
+
+
+def _read_dropdown(control: ft.Dropdown, spec: FieldSpec) -> Tuple[Any, Optional[str]]:
+    # Dropdownの値は通常文字列 (キー) なので型変換は不要 (enum定義による)
+    if control.value is None and spec.required:
+        return None, "選択してください。"
+    return control.value, None
+
+
+_READERS: Dict[type, Callable[[Any, FieldSpec], Tuple[Any, Optional[str]]]] = {
+    ft.TextField: _read_text,
+    ft.Checkbox: _read_checkbox,
+    ft.Dropdown: _read_dropdown,
+}
+
+
+# --- 入力コントロールの生成 (型ごとの関数。引数は 表示ラベル, 説明, デフォルト値, プロパティのスキーマ) ---
+def _build_enum(
+    display_label: str, description: Optional[str], default_value: Any, prop_schema: Dict[str, Any]
+) -> ft.Dropdown:
+    """文字列の enum は Dropdown にする"""
+    options = [ft.dropdown.Option(key=str(enum_val)) for enum_val in prop_schema["enum"]]
+    return ft.Dropdown(
+        label=display_label,
+        hint_text=description or "選択してください",
+        options=options,
+        value=str(default_value) if default_value is not None else None,
+        tooltip=description,
+    )
+
+
+def _build_string(
+    display_label: str, description: Optional[str], default_value: Any, prop_schema: Dict[str, Any]
+) -> ft.TextField:
+    """文字列は TextField にする (format が textarea なら複数行)"""
+    # 複数行かどうかの判定（例: format が textarea など）
+    is_multiline = prop_schema.get("format") == "textarea"  # MCP仕様による
+    return ft.TextField(
+        label=display_label,
+        hint_text=description,
+        value=str(default_value) if default_value is not None else "",
+        multiline=is_multiline,
+        min_lines=3 if is_multiline else 1,
+        max_lines=5 if is_multiline else 1,
+        tooltip=description,
+    )
+
+
+def _build_bool(
+    display_label: str, description: Optional[str], default_value: Any, prop_schema: Dict[str, Any]
+) -> ft.Checkbox:
+    """真偽値は Checkbox にする"""
+    return ft.Checkbox(
+        label=display_label,
+        value=bool(default_value) if default_value is not None else False,
+        tooltip=description,
+    )
+
+
+def _build_int(
+    display_label: str, description: Optional[str], default_value: Any, prop_schema: Dict[str, Any]
+) -> ft.TextField:
+    """整数は数字とマイナスだけを入力できる TextField にする"""
+    return ft.TextField(
+        label=display_label,
+        hint_text=description,
+        value=str(default_value) if default_value is not None else "",
+        keyboard_type=ft.KeyboardType.NUMBER,
+        input_filter=_INT_FILTER,
+        tooltip=description,
+    )
+
+
+def _build_number(
+    display_label: str, description: Optional[str], default_value: Any, prop_schema: Dict[str, Any]
+) -> ft.TextField:
+    """数値は数字と小数点とマイナスだけを入力できる TextField にする"""
+    return ft.TextField(
+        label=display_label,
+        hint_text=description,
+        value=str(default_value) if default_value is not None else "",
+        keyboard_type=ft.KeyboardType.NUMBER,
+        input_filter=_NUM_FILTER,
+        tooltip=description,
+    )
+
+
+# 型 (JSON Schema の type) ごとの入力コントロールの生成関数
+_BUILDERS: Dict[str, Callable[[str, Optional[str], Any, Dict[str, Any]], ft.Control]] = {
+    "string": _build_string,
+    "boolean": _build_bool,
+    "integer": _build_int,
+    "number": _build_number,
+}
 
 
 class ToolView(ft.View):
@@ -13,40 +266,68 @@ class ToolView(ft.View):
 
     page: ft.Page
 
+    # 入力中の検証は、最後のキー入力からこの時間 (秒) が経ってから行う
+    VALIDATE_DEBOUNCE_SECONDS = 0.2
+    # 入力欄がこの数より多い場合は、見えている範囲だけを描画する ListView に並べる
+    VIRTUALIZE_FIELDS_THRESHOLD = 20
+    # 出力欄の高さ(px)。文字サイズ16でおよそ15行分
+    OUTPUT_HEIGHT = 360
+    # 出力がこの文字数より長い場合は先頭だけを表示し、残りは「すべて表示」で表示する
+    OUTPUT_PREVIEW_CHARS = 8192
+    # 実行中の進捗を出力欄に表示するときの、画面を更新する最短の間隔(秒)と、表示する最大行数
+    PROGRESS_UPDATE_INTERVAL = 0.1
+    PROGRESS_MAX_LINES = 200
+    # 入力欄がこの数より多いツールは、入力フォームを開くボタンが押されるか実行するまで入力欄を作らない
+    DEFER_FORM_FIELDS_THRESHOLD = 30
+
     def __init__(self, page: ft.Page, mcp_client: MCPClient, tool_name: str):
         super().__init__(route=f"/tool/{tool_name}", scroll=ft.ScrollMode.ADAPTIVE, padding=ft.padding.all(20))
         self.page = page
         self.mcp_client = mcp_client
         self.tool_name = tool_name
-        # HomeViewから渡されたツール情報を取得
-        # --- page オブジェクトの一時属性から取得 ---
-        self.tool_info: Optional[Tool] = None
-        try:
-            if hasattr(self.page, "selected_tool_info_temp"):
-                self.tool_info = self.page.selected_tool_info_temp  # type: ignore
-                print(f"page オブジェクトからツール '{tool_name}' の情報を取得しました。")
-                # 取得したら一時属性を削除する
-                delattr(self.page, "selected_tool_info_temp")
-            else:
-                print(f"警告: page オブジェクトに '{tool_name}' の一時情報が見つかりませんでした。")
-        except Exception as ex:
-            print(f"ページ属性の取得または削除中にエラー: {ex}")
+        # HomeViewで選ばれたときに登録されたツール情報を取得 (同じツールを開き直しても取得できる)
+        self.tool_info: Optional[Tool] = _TOOL_INFO_CACHE.get(tool_name)
+        if self.tool_info is None:
+            log.warning("ツール '%s' の情報が登録されていません。", tool_name)
 
         self.input_controls: Dict[str, ft.Control] = {}  # 入力コントロールを保持 {input_name: control}
-        self.output_area = ft.TextField(
-            label="出力",
-            read_only=True,
-            multiline=True,
-            min_lines=5,
-            max_lines=15,
-            value="結果がここに表示されます。",
-            expand=True,  # 縦にスペースを広げる
-            text_size=16,  # 結果が見やすいように少し小さく
-            border_color=ft.Colors.OUTLINE,
+        # 入力スキーマのバリデーター (最初の実行時に取得する)
+        self._validator: Optional[Callable[[Any], Any]] = None
+        self._validator_loaded = False
+        # 入力欄ごとのスキーマ情報 {input_name: FieldSpec} (create_input_form で設定する)
+        self._field_specs: Dict[str, FieldSpec] = {}
+        # 実行時の検証で順に見ていく、入力欄の名前・コントロール・スキーマ情報 (同じ位置が同じ入力欄)
+        self._field_names: List[str] = []
+        self._field_controls: List[ft.Control] = []
+        self._field_spec_list: List[FieldSpec] = []
+        # 作るのを後回しにしている入力フォームの代わりに置いているコントロール (作ったら None)
+        self._deferred_form: Optional[ft.Control] = None
+        # 入力中の検証を遅らせて行うタスク (キー入力のたびに取り消して予約し直す)
+        self._debounce_task: Optional[asyncio.Task] = None
+        # 出力は編集しないため、入力用の TextField ではなく選択・コピーできる Text で表示する
+        self.output_text = ft.Text(value="結果がここに表示されます。", selectable=True, size=16)
+        self.output_area = ft.Container(
+            # 長い結果は枠の中でスクロールさせる
+            content=ft.Column([self.output_text], scroll=ft.ScrollMode.AUTO),
+            height=self.OUTPUT_HEIGHT,
+            padding=10,
+            border=ft.border.all(1, ft.Colors.OUTLINE),
+            border_radius=4,
         )
+        # 省略した出力の全文と、それを表示するボタン
+        self._full_output = ""
+        self.show_all_button = ft.TextButton("すべて表示", visible=False, on_click=self.show_full_output)
         self.run_button = ft.ElevatedButton("Run", on_click=self.run_tool)
         self.status_text = ft.Text(value="", color=ft.Colors.ERROR)
         self.progress_ring = ft.ProgressRing(visible=False, width=16, height=16)  # 小さめのリング
+        # ツールの実行中・実行後に表示が変わるコントロール (画面全体ではなくこれらだけを更新する)
+        self._run_controls = (
+            self.run_button,
+            self.progress_ring,
+            self.status_text,
+            self.output_text,
+            self.show_all_button,
+        )
 
         # AppBar
         self.appbar = ft.AppBar(
@@ -66,15 +347,29 @@ class ToolView(ft.View):
         tool_description = self.tool_info.description or "説明がありません。"
         input_schema = self.tool_info.inputSchema or {}
 
-        input_form_controls = self.create_input_form(input_schema)
+        input_form: ft.Control
+        num_fields = len(input_schema.get("properties", {}))
+        cached = _form_cache(self.page).get(self.tool_name)
+        if num_fields > self.DEFER_FORM_FIELDS_THRESHOLD and (
+            cached is None or cached[0] != _schema_hash(input_schema)
+        ):
+            # 入力欄が多いツールは、一覧から開いただけでは入力欄を作らず、開くボタンだけを置く
+            input_form = ft.Row(
+                [
+                    ft.Text(f"入力項目: {num_fields} 件"),
+                    ft.ElevatedButton("入力フォームを開く", on_click=self._expand_form),
+                ],
+                vertical_alignment=ft.CrossAxisAlignment.CENTER,
+            )
+            self._deferred_form = input_form
+        else:
+            input_form = self._build_input_form(input_schema)
 
         return [
             ft.Text(tool_description, weight=ft.FontWeight.BOLD, size=16),
             ft.Divider(height=10),
             ft.Text("入力:", weight=ft.FontWeight.BOLD),
-            ft.Column(input_form_controls, spacing=15)
-            if input_form_controls
-            else ft.Text("このツールは入力を必要としません。"),
+            input_form,
             ft.Divider(height=10),
             ft.Row(
                 [
@@ -86,13 +381,51 @@ class ToolView(ft.View):
             ),
             self.status_text,
             ft.Divider(height=10),
-            # ft.Text("出力:", weight=ft.FontWeight.BOLD), # TextFieldにLabelがあるので不要かも
-            ft.Container(  # 出力エリアを少し目立たせる
-                content=self.output_area,
-                expand=True,  # 残りのスペースを埋める
+            ft.Row(
+                [ft.Text("出力:", weight=ft.FontWeight.BOLD), self.show_all_button],
+                alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
             ),
+            self.output_area,
         ]
 
+    def _build_input_form(self, input_schema: Dict[str, Any]) -> ft.Control:
+        """入力フォームを作る (同じスキーマで作ったことがあれば、そのときの入力欄を使い回す)"""
+        schema_hash = _schema_hash(input_schema)
+        form_cache = _form_cache(self.page)
+        cached = form_cache.get(self.tool_name)
+        if cached is not None and cached[0] == schema_hash:
+            _, input_form_controls, self.input_controls, self._field_specs = cached
+            # 入力欄のイベントは前に開いたときの画面に結び付いているため、この画面に付け替える
+            self._bind_field_handlers()
+        else:
+            input_form_controls = self.create_input_form(input_schema)
+            form_cache[self.tool_name] = (schema_hash, input_form_controls, self.input_controls, self._field_specs)
+        self._field_names = list(self.input_controls)
+        self._field_controls = list(self.input_controls.values())
+        self._field_spec_list = [self._field_specs[name] for name in self._field_names]
+
+        if not input_form_controls:
+            return ft.Text("このツールは入力を必要としません。")
+        if len(input_form_controls) > self.VIRTUALIZE_FIELDS_THRESHOLD:
+            # 入力欄が多い場合は ListView 自身がスクロールするため、画面全体のスクロールは止める (入れ子にしない)
+            self.scroll = None
+            return ft.ListView(input_form_controls, spacing=15, expand=True)
+        return ft.Column(input_form_controls, spacing=15)
+
+    def _ensure_input_form(self) -> bool:
+        """後回しにしていた入力フォームを作って表示する. 作った場合は True を返す (画面の更新は呼び出し側で行う)"""
+        if self._deferred_form is None or self.tool_info is None:
+            return False
+        index = self.controls.index(self._deferred_form)
+        self.controls[index] = self._build_input_form(self.tool_info.inputSchema or {})
+        self._deferred_form = None
+        return True
+
+    async def _expand_form(self, e):
+        """「入力フォームを開く」がクリックされたときの処理"""
+        if self._ensure_input_form():
+            self.update()
+
     def create_input_form(self, schema: Dict[str, Any]) -> list:
         """
         JSON Schema (input_schema) に基づいて Flet 入力コントロールを生成する。
@@ -108,161 +441,213 @@ class ToolView(ft.View):
         for name, prop_schema in properties.items():
             label = prop_schema.get("title", name)
             description = prop_schema.get("description")
-            field_type = prop_schema.get("type", "string")
+            # anyOf などで型を決められない場合は文字列として入力させる (スキーマでの検証はしない)
+            type_schema = _resolve_type_schema(prop_schema)
+            field_type = (type_schema or prop_schema).get("type", "string")
             default_value = prop_schema.get("default")
             is_required = name in required
             display_label = f"{label}{' *' if is_required else ''}"
 
-            control: Optional[ft.Control] = None
-
             # --- 型に応じたコントロール生成 ---
-            if "enum" in prop_schema and field_type == "string":  # 文字列のenumはDropdown
-                options = [ft.dropdown.Option(key=str(enum_val)) for enum_val in prop_schema["enum"]]
-                control = ft.Dropdown(
-                    label=display_label,
-                    hint_text=description or "選択してください",
-                    options=options,
-                    value=str(default_value) if default_value is not None else None,
-                    tooltip=description,
-                )
-            elif field_type == "string":
-                # 複数行かどうかの判定（例: format が textarea など）
-                is_multiline = prop_schema.get("format") == "textarea"  # MCP仕様による
-                control = ft.TextField(
-                    label=display_label,
-                    hint_text=description,
-                    value=str(default_value) if default_value is not None else "",
-                    multiline=is_multiline,
-                    min_lines=3 if is_multiline else 1,
-                    max_lines=5 if is_multiline else 1,
-                    tooltip=description,
-                )
-            elif field_type == "boolean":
-                control = ft.Checkbox(
-                    label=display_label,
-                    value=bool(default_value) if default_value is not None else False,
-                    tooltip=description,
-                )
-            elif field_type == "integer":
-                control = ft.TextField(
-                    label=display_label,
-                    hint_text=description,
-                    value=str(default_value) if default_value is not None else "",
-                    keyboard_type=ft.KeyboardType.NUMBER,
-                    input_filter=ft.InputFilter(r"[0-9\-]"),  # 整数のみ許可 (マイナスも)
-                    tooltip=description,
-                )
-            elif field_type == "number":
-                control = ft.TextField(
-                    label=display_label,
-                    hint_text=description,
-                    value=str(default_value) if default_value is not None else "",
-                    keyboard_type=ft.KeyboardType.NUMBER,
-                    # 小数点とマイナスを許可 (より厳密な正規表現も可能)
-                    input_filter=ft.InputFilter(r"[0-9\.\-]"),
-                    tooltip=description,
-                )
-            # --- 他の型 (array, object など) のサポートを追加する場合はここに記述 ---
+            if type_schema is not None and "enum" in type_schema and field_type == "string":  # 文字列のenumはDropdown
+                builder = _build_enum
             else:
+                builder = _BUILDERS.get(field_type)
+            if builder is None:
+                # 他の型 (array, object など) のサポートを追加する場合は _BUILDERS に登録する
                 controls.append(ft.Text(f"未対応の入力タイプ '{field_type}' for '{name}'", color=ft.Colors.ORANGE))
                 continue  # このフィールドは追加しない
-
-            if control:
-                self.input_controls[name] = control
-                controls.append(control)
-
+            control = builder(display_label, description, default_value, type_schema or prop_schema)
+
+            self.input_controls[name] = control
+            self._field_specs[name] = FieldSpec(
+                field_type=field_type,
+                required=is_required,
+                title=label,
+                error_prefix=f"'{label}': ",
+                invalid_error_text=f"不正な{field_type}値",
+                invalid_error_line=f"'{label}' に有効な{field_type}値を入力してください。",
+                coerce=_COERCERS.get(field_type, str),
+                schema=prop_schema,
+                checkable=type_schema is not None,
+                supports_error_text=isinstance(control, (ft.TextField, ft.Dropdown)),
+                read=_READERS[type(control)],
+            )
+            controls.append(control)
+
+        self._bind_field_handlers()
         return controls
 
-    def _validate_inputs(self) -> Optional[Dict[str, Any]]:
-        """入力値を取得し、バリデーションを行う。エラーがあればNone、なければ入力辞書を返す。"""
-        inputs = {}
-        errors = []
-        input_schema = self.tool_info.inputSchema if (self.tool_info) and (self.tool_info.inputSchema) else {}
-        properties = input_schema.get("properties", {})
-        required_fields = input_schema.get("required", [])
-
+    def _bind_field_handlers(self):
+        """テキストの入力欄に、この画面の入力中・フォーカスが外れたときの検証を設定する"""
         for name, control in self.input_controls.items():
-            prop_schema = properties.get(name, {})
-            field_type = prop_schema.get("type", "string")
-            is_required = name in required_fields
-            value = None
-            error_msg = None
-
-            # --- 値の取得と型変換 ---
-            try:
-                if isinstance(control, ft.TextField):
-                    raw_value = control.value.strip() if control.value else ""
-                    if not raw_value and is_required:
-                        error_msg = "必須項目です。"
-                    elif raw_value:  # 値がある場合のみ型変換
-                        if field_type == "integer":
-                            value = int(raw_value)
-                        elif field_type == "number":
-                            value = float(raw_value)
-                        else:  # string
-                            value = raw_value
-                    elif not raw_value and not is_required and control.value is not None:  # 空文字を許容する場合
-                        value = ""
-
-                elif isinstance(control, ft.Checkbox):
-                    value = control.value  # bool
-
-                elif isinstance(control, ft.Dropdown):
-                    value = control.value  # 文字列 (キー) or None
-                    if value is None and is_required:
-                        error_msg = "選択してください。"
-                    # Dropdownの値は通常文字列なので型変換は不要 (enum定義による)
-
-                # --- バリデーションメッセージの設定 ---
-                if error_msg:
-                    errors.append(f"'{prop_schema.get('title', name)}': {error_msg}")
-                    if hasattr(control, "error_text"):
-                        control.error_text = error_msg  # type: ignore
-                elif hasattr(control, "error_text"):
-                    control.error_text = None  # type: ignore # エラー解消
-
-                # エラーがなければ値をinputsに追加（Noneでない場合 or booleanの場合）
-                # MCPサーバーが空文字やnullをどう扱うかによる調整が必要な場合あり
-                if error_msg is None and (value is not None or field_type == "boolean"):
-                    inputs[name] = value
-
-            except ValueError:
-                error_msg = f"'{prop_schema.get('title', name)}' に有効な{field_type}値を入力してください。"
-                errors.append(error_msg)
-                if hasattr(control, "error_text"):
-                    control.error_text = f"不正な{field_type}値"  # type: ignore
+            if isinstance(control, ft.TextField):
+                # 入力中は簡単なチェックだけを間引いて行い、スキーマでの検証はフォーカスが外れたときに行う
+                control.data = name
+                control.on_change = self._on_field_change
+                control.on_blur = self._on_field_blur
+
+    def _validate_inputs(self) -> Tuple[Optional[Dict[str, Any]], List[ft.Control]]:
+        """
+        入力値を取得し、バリデーションを行う。エラーがあればNone、なければ入力辞書を返す。
+        あわせて、エラー表示が変わった入力欄のリストを返す (画面の更新はこれらとステータス欄だけで済む)。
+        """
+        inputs: Dict[str, Any] = {}
+        errors: List[str] = []  # ステータス欄に表示するエラー (最後に1回だけ連結する)
+        changed: List[ft.Control] = []
+
+        for name, control, spec in zip(self._field_names, self._field_controls, self._field_spec_list):
+            value, error = self._read_field(spec, control, changed)
+            if error is not None:
+                errors.append(error)
+            # エラーがなければ値をinputsに追加（Noneでない場合 or booleanの場合）
+            # MCPサーバーが空文字やnullをどう扱うかによる調整が必要な場合あり
+            elif value is not None or spec.field_type == "boolean":
+                inputs[name] = value
+
+        # 入力欄ごとのチェックを通った値を、スキーマ全体 (範囲・パターン・enum など) でまとめて検証する
+        if not errors:
+            if not self._validator_loaded:
+                input_schema = self.tool_info.inputSchema if (self.tool_info) and (self.tool_info.inputSchema) else {}
+                self._validator = _get_validator(self.tool_name, _validation_schema(input_schema, self._field_specs))
+                self._validator_loaded = True
+            if self._validator is not None:
+                try:
+                    self._validator(inputs)
+                except fastjsonschema.JsonSchemaValueException as ex:
+                    # ex.path は ["data", プロパティ名, ...]。メッセージ先頭の "data.xxx " を除いて入力欄に表示する
+                    name = ex.path[1] if len(ex.path) > 1 else None
+                    message = ex.message.removeprefix(f"{ex.name} ")
+                    failed_spec = self._field_specs.get(name) if name else None
+                    errors.append((failed_spec.error_prefix if failed_spec else f"'{name or '入力'}': ") + message)
+                    control = self.input_controls.get(name) if name else None
+                    if failed_spec is not None and control is not None:
+                        _set_error_text(failed_spec, control, message, changed)
 
         if errors:
             self.status_text.value = "入力エラー:\n" + "\n".join(errors)
             self.status_text.color = ft.Colors.ERROR
-            return None  # バリデーション失敗
+            return None, changed  # バリデーション失敗
         else:
             self.status_text.value = ""  # エラーメッセージクリア
-            return inputs  # バリデーション成功
+            return inputs, changed  # バリデーション成功
+
+    def _read_field(
+        self, spec: FieldSpec, control: ft.Control, changed: Optional[List[ft.Control]] = None
+    ) -> Tuple[Any, Optional[str]]:
+        """
+        入力欄の値を取得して型変換し、入力欄のエラー表示を更新する (表示が変わった入力欄は changed に追加する).
+        (値, エラー) を返す. エラーはステータス欄に表示する1行で、問題がなければ None.
+        """
+        # --- 値の取得と型変換 ---
+        try:
+            value, error_msg = spec.read(control, spec)
+        except ValueError:
+            _set_error_text(spec, control, spec.invalid_error_text, changed)
+            return None, spec.invalid_error_line
+
+        # --- バリデーションメッセージの設定 ---
+        _set_error_text(spec, control, error_msg, changed)  # None ならエラー解消
+        if error_msg:
+            return None, spec.error_prefix + error_msg
+        return value, None
+
+    async def _on_field_change(self, e: ft.ControlEvent):
+        """入力欄が変更されたときの処理. 連続したキー入力の検証は、入力が止まってから1回だけ行う"""
+        self.cancel_pending_validation()
+        self._debounce_task = asyncio.create_task(self._debounced_validate(e.control))
+
+    async def _debounced_validate(self, control: ft.TextField):
+        """少し待ってから、入力欄1つ分の型と必須のチェックを行う"""
+        await asyncio.sleep(self.VALIDATE_DEBOUNCE_SECONDS)
+        if control.page is None:
+            return  # 待っている間に画面から外された
+        self._read_field(self._field_specs[control.data], control)
+        control.update()
+
+    def cancel_pending_validation(self):
+        """待機中の入力欄の検証を取り消す (画面を閉じたときにも呼ぶ)"""
+        if self._debounce_task is not None and not self._debounce_task.done():
+            self._debounce_task.cancel()
+        self._debounce_task = None
+
+    async def _on_field_blur(self, e: ft.ControlEvent):
+        """入力欄からフォーカスが外れたときの処理. 入力欄1つ分をプロパティのスキーマでも検証する"""
+        self.cancel_pending_validation()
+        control = e.control
+        name = control.data
+        spec = self._field_specs[name]
+        value, error = self._read_field(spec, control)
+        # 型を決められないプロパティ (候補が複数の anyOf など) は、文字列のまま検証すると誤ったエラーになるため除く
+        if error is None and value is not None and spec.checkable:
+            validator = _get_validator(f"{self.tool_name}.{name}", spec.schema)
+            if validator is not None:
+                try:
+                    validator(value)
+                except fastjsonschema.JsonSchemaValueException as ex:
+                    control.error_text = ex.message.removeprefix(f"{ex.name} ")
+        control.update()
+
+    def set_output(self, text: str):
+        """出力欄に結果を表示する. 長い結果は先頭だけを表示し、全文は「すべて表示」で表示できるようにする"""
+        self._full_output = text
+        is_truncated = len(text) > self.OUTPUT_PREVIEW_CHARS
+        if is_truncated:
+            text = f"{text[: self.OUTPUT_PREVIEW_CHARS]}\n… (一部のみ表示しています)"
+        self.output_text.value = text
+        self.show_all_button.visible = is_truncated
+
+    async def show_full_output(self, e):
+        """「すべて表示」ボタンがクリックされたときに、省略していた出力の全文を表示する"""
+        self.output_text.value = self._full_output
+        self.show_all_button.visible = False
+        self.page.update(self.output_text, self.show_all_button)
+
+    def _make_progress_callback(self) -> Callable[[float, Optional[float], Optional[str]], Awaitable[None]]:
+        """
+        ツールの進捗通知を出力欄に表示するコールバックを作る.
+        直近の PROGRESS_MAX_LINES 行だけを残し、画面の更新は PROGRESS_UPDATE_INTERVAL ごとにまとめる
+        (間引いた分は、実行結果で出力欄を置き換えるため表示しなくてよい).
+        """
+        lines: deque[str] = deque(maxlen=self.PROGRESS_MAX_LINES)
+        last_update = 0.0
+
+        async def on_progress(progress: float, total: Optional[float], message: Optional[str]) -> None:
+            nonlocal last_update
+            position = f"{progress:g}/{total:g}" if total else f"{progress:g}"
+            lines.append(f"[{position}] {message}" if message else f"[{position}]")
+            now = time.monotonic()
+            if now - last_update >= self.PROGRESS_UPDATE_INTERVAL:
+                self.set_output("\n".join(lines))
+                self.page.update(self.output_text, self.show_all_button)
+                last_update = now
+
+        return on_progress
 
     async def run_tool(self, e):
         """Runボタンがクリックされたときの処理"""
-        validated_inputs = self._validate_inputs()
+        if self._ensure_input_form():
+            # 入力フォームを開かずに実行された場合は、ここでフォームを作って表示してから検証する
+            self.update()
+        validated_inputs, changed_controls = self._validate_inputs()
 
         if validated_inputs is None:  # バリデーション失敗
-            self.page.update()
+            self.page.update(self.status_text, *changed_controls)
             return
 
         self.run_button.disabled = True
         self.progress_ring.visible = True
         self.status_text.value = "実行中..."
         self.status_text.color = ft.Colors.BLUE
-        self.output_area.value = ""  # 出力エリアをクリア
-        self.page.update()
+        self.set_output("")  # 出力エリアをクリア
+        self.page.update(*self._run_controls, *changed_controls)
 
         try:
-            result = await self.mcp_client.run_tool(self.tool_name, validated_inputs)
-            # 結果を整形して表示
-            try:
-                for content in result.content:
-                    self.output_area.value = content.text  # type: ignore
-            except Exception:
-                self.output_area.value = str(result.content)
+            result = await self.mcp_client.run_tool(
+                self.tool_name, validated_inputs, progress_callback=self._make_progress_callback()
+            )
+            # 大きな結果の文字列化でUIが止まらないよう、整形は別スレッドで行う
+            self.set_output(await asyncio.to_thread(_format_result, result))
 
             self.status_text.value = "実行が完了しました。"
             self.status_text.color = ft.Colors.GREEN
@@ -270,12 +655,12 @@ class ToolView(ft.View):
         except (ValueError, ConnectionError, TimeoutError, RuntimeError) as ex:
             self.status_text.value = f"ツールの実行に失敗しました:\n{ex}"
             self.status_text.color = ft.Colors.ERROR
-            self.output_area.value = f"エラー:\n{ex}"  # エラー詳細も出力欄に表示
+            self.set_output(f"エラー:\n{ex}")  # エラー詳細も出力欄に表示
         except Exception as ex:
             self.status_text.value = f"予期しないエラーが発生しました:\n{ex}"
             self.status_text.color = ft.Colors.ERROR
-            self.output_area.value = f"予期しないエラー:\n{ex}"
+            self.set_output(f"予期しないエラー:\n{ex}")
         finally:
             self.run_button.disabled = False
             self.progress_ring.visible = False
-            self.page.update()
+            self.page.update(*self._run_controls)